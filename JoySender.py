@@ -1,21 +1,49 @@
 import time
+_import_start = time.perf_counter()
 
-import pygame
+import os
 import socket
 import ipaddress
 import argparse
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 from utils.helper_functions import *
 from utils.gamepad_mapping import *
+from utils.device_monitor import *
+from utils.session import *
+from utils.fake_devices import open_fake_device, FakeHotplugMonitor, FAKE_REPORT_RATE
+from utils.hotkeys import HotkeyFlags, wait_for_key_release
+from utils.pipeline import SplitConnection, pin_to_cpu
+from utils.stage_timers import *
+from utils.rumble import RumbleState, PYGAME_RUMBLE_DURATION_MS
+from utils.ds4_output import DS4OutputWriter
+from utils.ds4_reports import *
+from utils.event_loop import EpollFrameWaiter, host_still_connected
+from utils.hid_decode_cache import HidDecodeCache, HID_DECODE_LRU_SIZE
+from utils.stick_hysteresis import get_stick_hysteresis, STICK_HYSTERESIS_STRENGTH
+from utils.realtime import RealtimeMode, parse_realtime_cpus
 from utils.xbox_reports import XBOX_REPORT
 
-import colorama
-colorama.init()
+startup_profile['import JoySender modules'] = time.perf_counter() - _import_start
+
+# heavy modules are only imported when a mode first needs them, HID modes never import pygame
+pygame = LazyModule('pygame')
+
+# colorama is only needed to translate ANSI cursor codes on windows
+if sys.platform == 'win32':
+    with profile_step('import colorama'):
+        import colorama
+    colorama.init()
 
 RESTART = 'shift+R'
 QUIT = 'shift+Q'
 REMAP = 'shift+M'
+TIMING = 'shift+T'
+SPLIT_INPUT_OVERSAMPLE = 4  # in split mode the input process samples this many times per network frame
+
+# button maps loaded this session by map file, kept across warm restarts
+loaded_button_maps = {}
 
 
 def get_parsed_args():
@@ -31,11 +59,66 @@ def get_parsed_args():
     parser.add_argument('-l', '--latency', action='store_true', help='Show latency output')
     parser.add_argument('-s', '--select', action='store_true', help='Show select input menu')
     parser.add_argument('-a', '--auto', type=bool, help='set to true or false for auto select input')
+    parser.add_argument('-r', '--resume', action='store_true',
+                        help='Reopen the last session\'s device and host without prompting')
+    parser.add_argument('--split', action='store_true',
+                        help='Run input and network in separate processes sharing the latest frame')
+    parser.add_argument('--cpus', type=str,
+                        help='Cores to pin the split input and network processes to, as INPUT,NETWORK')
+    parser.add_argument('-t', '--stage-timing', action='store_true',
+                        help='Time each stage of the send loop from the start, Shift+T toggles it at runtime')
+    parser.add_argument('--trace', type=str,
+                        help='Write stage timings to this Chrome trace JSON file when timing stops')
+    parser.add_argument('--startup-profile', action='store_true',
+                        help='Report import and init time per module during startup')
+    parser.add_argument('--motion', choices=DS4_MOTION_POLICIES, default='full',
+                        help='DS4 passthrough motion data: full rate, decimated to --motion-rate Hz, or zeroed')
+    parser.add_argument('--motion-rate', type=int, default=DS4_MOTION_RATE,
+                        help='Motion updates per second with --motion decimate')
+    parser.add_argument('--batch', action='store_true',
+                        help='DS4 passthrough: send every report read since the last frame in one batched frame')
+    parser.add_argument('--realtime', nargs='?', const='', metavar='CPUS',
+                        help='Freeze the GC and collect only in idle time once running, pin to CPUS (linux) '
+                             'and report frame time jitter before and after')
+    parser.add_argument('--sched-fifo', action='store_true',
+                        help='With --realtime, also ask for SCHED_FIFO scheduling if permitted')
+    parser.add_argument('--mlock', action='store_true',
+                        help='With --realtime, also lock all memory with mlockall if permitted')
+    parser.add_argument('--epoll', action='store_true',
+                        help='Wait on the device, host socket and frame timer with one epoll (linux), '
+                             'needs --backend hidraw in modes 2 and 3 or --backend evdev in mode 1')
+    parser.add_argument('--decode-lru', nargs='?', type=int, const=HID_DECODE_LRU_SIZE, default=0, metavar='SIZE',
+                        help=f'In mode 3, also keep the decoded xbox reports of the last SIZE distinct HID reports '
+                             f'(default {HID_DECODE_LRU_SIZE})')
+    parser.add_argument('--stick-hysteresis', nargs='?', type=float, const=STICK_HYSTERESIS_STRENGTH, default=0,
+                        metavar='STRENGTH',
+                        help='In mode 3, hold each stick until it moves more than STRENGTH times its noise band, '
+                             f'or reaches or crosses its centre (default {STICK_HYSTERESIS_STRENGTH})')
+    parser.add_argument('--backend', choices=['real', 'fake', 'evdev', 'hidraw'], default='real',
+                        help='Read real devices, a fake device that needs no hardware, '
+                             'or on linux read /dev/input event devices in mode 1 or /dev/hidraw devices '
+                             'in modes 2 and 3 directly')
+    parser.add_argument('--fake-source', type=str, default='random',
+                        help='Fake device input: random, random:SEED, script:FILE or capture:FILE')
+    parser.add_argument('--fake-rate', type=int, default=FAKE_REPORT_RATE,
+                        help='Reports per second produced by the fake device')
 
     # Parse and return the arguments
     return parser.parse_args()
 
 
+def apply_session_settings(args, session):
+    # values given on the command line take priority over the saved session
+    if not args.host:
+        args.host = session['host']
+    if not args.port:
+        args.port = str(session['port'])
+    if not args.fps:
+        args.fps = str(session['fps'])
+    if not args.mode:
+        args.mode = session['op_mode']
+
+
 def get_arg_settings(args):
     # set port
     if args.port:
@@ -62,33 +145,68 @@ def get_arg_settings(args):
 
 
 def wait_for_no_keyboard_input():
-    while True:
-        if not keyboard.is_pressed('shift') and not keyboard.is_pressed('M') \
-                and not keyboard.is_pressed('R') and not keyboard.is_pressed('1') \
-                and not keyboard.is_pressed('2') and not keyboard.is_pressed('3'):
-            return 1
+    wait_for_key_release(['shift', 'M', 'R', '1', '2', '3'])
+    return 1
+
+
+def init_pygame_joystick():
+    global pygame
+    if args.backend == 'evdev':
+        # joysticks are read from their evdev devices, SDL is never loaded, linux only so imported here
+        from utils.evdev_input import EvdevPygame
+        pygame = EvdevPygame()
+        return
+    # Only the joystick subsystem is used, SDL also needs the display subsystem to pump its events
+    if args.backend == 'fake':
+        # fake joysticks run on headless machines, pygame only pumps an empty event queue
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    with profile_step('pygame.display.init'):
+        pygame.display.init()
+    with profile_step('pygame.joystick.init'):
+        pygame.joystick.init()
+    # joystick state is polled, only hotplug events are taken off the queue, any other event would fill it
+    # until SDL starts dropping events, removals included
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed([pygame.JOYDEVICEADDED, pygame.JOYDEVICEREMOVED])
+
+
+def select_session_device(session):
+    # reopen the exact device from the last session, falling back to normal selection
+    if session['op_mode'] == 1:
+        init_pygame_joystick()
+    gamepad, vendor_id, product_id = open_session_device(pygame, session)
+    if not gamepad:
+        print("<< Last session's device was not found >>")
+    return gamepad, vendor_id, product_id
 
 
 def select_device(op_mode, auto_select):
     vendor_id = product_id = None
+    if args.backend == 'fake':
+        if op_mode == 1:
+            init_pygame_joystick()
+        gamepad, vendor_id, product_id = open_fake_device(op_mode, args.fake_source, args.fake_rate)
+        return gamepad, op_mode, vendor_id, product_id
+    # one enumeration snapshot is shared by every selection path
+    hid_devices = enumerate_hid_devices() if op_mode != 1 else None
     # if passthrough_mode attempt auto select ps4 controller
     if op_mode == 2:
-        gamepad, vendor_id, product_id = select_hid_device([d for d in hid.enumerate() if d['product_id'] == 2508])
+        gamepad, vendor_id, product_id = select_hid_device([d for d in hid_devices if d['product_id'] == 2508])
         if not gamepad:
-            gamepad, vendor_id, product_id = select_hid_device(hid.enumerate(), 0, 'PyGame Device')
+            gamepad, vendor_id, product_id = select_hid_device(list(hid_devices), 0, 'PyGame Device')
             if gamepad == -1:
                 op_mode = 1
                 auto_select = 0
 
     if op_mode == 3:
-        gamepad, vendor_id, product_id = select_hid_device(hid.enumerate(), 0, 'PyGame Device')
+        gamepad, vendor_id, product_id = select_hid_device(list(hid_devices), 0, 'PyGame Device')
         if gamepad == -1:
             op_mode = 1
             auto_select = 0
 
     # else run pygame mode
     if op_mode == 1:
-        pygame.init()
+        init_pygame_joystick()
         # User selects gamepad
         # if auto is off select with other option
         gamepad = select_pygame_device(pygame, auto_select, 'Another Device (HID)')
@@ -97,7 +215,8 @@ def select_device(op_mode, auto_select):
             sys.exit()
         # if other picked set hid mode and select device
         if gamepad == -1:
-            gamepad, vendor_id, product_id = select_hid_device(hid.enumerate())
+            hid_devices = hid_devices if hid_devices is not None else enumerate_hid_devices()
+            gamepad, vendor_id, product_id = select_hid_device(list(hid_devices))
             op_mode = 3
         if not gamepad:
             sys.exit()
@@ -117,19 +236,66 @@ def flush_HID_buffer(gamepad, clock, ds4_data_offset):
 
     if ds4_data_offset == 3:
         if sleep_time > 0:  # works well when connected via BT but causes input delay when connected via USB
-            pygame.time.wait(int(sleep_time - DS4_REPORTING_DELAY))
-            data = gamepad.read(64)
-            pygame.time.wait(int(DS4_REPORTING_DELAY))
+            wait_ms(int(sleep_time - DS4_REPORTING_DELAY))
+            data = gamepad.read(64, HID_READ_TIMEOUT_MS)
+            wait_ms(int(DS4_REPORTING_DELAY))
     else:
         # produces inaccurate (higher) frame rate but no input delay on USB
         for x in range(int(sleep_time / DS4_REPORTING_DELAY)-1):
-            data = gamepad.read(64)
-            pygame.time.wait(int(DS4_REPORTING_DELAY))
+            data = gamepad.read(64, HID_READ_TIMEOUT_MS)
+            wait_ms(int(DS4_REPORTING_DELAY))
 
     clock.last_frame_time = current_time
     clock.frame_count += 1
 
 
+def flush_HID_buffer_or_mark_lost(gamepad, clock, ds4_data_offset, device_monitor):
+    # most of a mode 2 frame is spent flushing, an unplug here is handled by the next read's reconnect
+    try:
+        flush_HID_buffer(gamepad, clock, ds4_data_offset)
+    except (OSError, IOError):
+        if device_monitor:
+            device_monitor.mark_lost()
+
+
+def collect_ds4_batch(gamepad, clock, batch, buffer, frames, report, ds4_data_offset, ds4_filter):
+    # batching acts as the frame limiter, every report that arrives before the next send is kept
+    # instead of being flushed, stamped with the time it was read
+    batch.clear()
+    deadline = clock.last_frame_time + clock.target_frame_time / 1000
+    reports_read = 0
+    timeout_ms = HID_READ_TIMEOUT_MS  # wait for at least one report even when the round trip ran late
+    while timeout_ms > 0:
+        if args.backend == 'hidraw':
+            report_length = gamepad.readinto(frames[:64], timeout_ms)
+        else:
+            input_report = gamepad.read(64, timeout_ms)
+            report_length = len(input_report)
+            buffer[:report_length] = input_report
+        if not report_length:
+            break
+        reports_read += 1
+        frame = frames[ds4_data_offset:report_length]
+        if ds4_filter.process(frame, report):
+            batch.add(frame, time.monotonic_ns() // 1000)
+        timeout_ms = int((deadline - time.monotonic()) * 1000)
+
+    clock.last_frame_time = time.monotonic()
+    clock.frame_count += 1
+    return reports_read
+
+
+def get_frame_waiter(gamepad, client_socket):
+    # --epoll waits on file descriptors, so only hidraw and evdev devices and a real socket can be used
+    if not args.epoll or not client_socket:
+        return None
+    if not hasattr(gamepad, 'fileno'):
+        print("<< --epoll needs --backend hidraw or evdev, using the normal loop >>")
+        args.epoll = False
+        return None
+    return EpollFrameWaiter(gamepad, client_socket, TARGET_FPS)
+
+
 def get_host_address():
     # request server ip address
     while True:
@@ -148,13 +314,42 @@ def get_host_address():
     return host_address
 
 
+def parse_split_cpus(cpus):
+    # --cpus INPUT,NETWORK
+    if not cpus:
+        return None, None
+    input_cpu, network_cpu = (int(cpu) for cpu in cpus.split(','))
+    return input_cpu, network_cpu
+
+
+def establish_split_connection(ip_address, op_mode):
+    # the network process owns the socket, this process only exchanges frames with it through shared memory
+    client_socket = SplitConnection(ip_address, PORT, TARGET_FPS, op_mode, parse_split_cpus(args.cpus)[1])
+    if not client_socket.start():
+        print("<< Connection Failed >>")
+        return False
+
+    print("Connected!")
+
+    return client_socket
+
+
+def get_handshake(op_mode):
+    # a host has to expect batched ds4 frames, so they are asked for in the handshake
+    if op_mode == 2 and args.batch:
+        return f'{TARGET_FPS}:{op_mode}:batch'
+    return f'{TARGET_FPS}:{op_mode}'
+
+
 def establish_connection(ip_address, op_mode):
+    if args.split:
+        return establish_split_connection(ip_address, op_mode)
     # establish client socket
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_address = (ip_address, PORT)
     try:
         client_socket.connect(server_address)
-        client_socket.sendall(str(f'{TARGET_FPS}:{op_mode}').encode())
+        client_socket.sendall(str(get_handshake(op_mode)).encode())
         response = client_socket.recv(1024)
     except Exception:
         print("<< Connection Failed >>")
@@ -177,8 +372,134 @@ def activate_ds4_extended_reports(gamepad, ds4_data_offset):
     return 0
 
 
-def joySender(operational_mode, auto_select):
-    clock = FpsLimiter(TARGET_FPS)
+def reconnect_device(gamepad, op_mode, vendor_id, product_id, device_guid, device_monitor):
+    # wait for the same device to come back, Shift+Q gives up
+    print("<< Device Lost >> Waiting for it to reconnect ...")
+    abort = lambda: HOTKEYS.triggered == QUIT
+    if op_mode == 1:
+        gamepad = wait_for_pygame_device(pygame, device_guid, abort)
+    else:
+        try:
+            gamepad.close()
+        except Exception:
+            pass
+        gamepad = wait_for_hid_device(vendor_id, product_id, device_monitor, abort)
+    if gamepad:
+        print("Device Reconnected!")
+    return gamepad
+
+
+def get_rumble_state(gamepad, op_mode, ds4_writer=None):
+    # rumble from the host is forwarded to ds4 and pygame devices, hid maps have no output path
+    if op_mode == 2:
+        # the ds4 holds its motor levels until the next output report
+        return RumbleState(ds4_writer.set_rumble)
+    if op_mode == 1:
+        return RumbleState(lambda left, right: pygame_rumble(gamepad, left, right, PYGAME_RUMBLE_DURATION_MS),
+                           PYGAME_RUMBLE_DURATION_MS)
+    return None
+
+
+def setup_device_phase(gamepad, op_mode):
+    # read the first report from the device and prepare it for the main loop
+    if op_mode == 2:
+        # first byte is used to determine where stick input starts
+        ds4_data_offset = DS4_BT_DATA_OFFSET if gamepad.read(64)[0] == 0x11 else DS4_USB_DATA_OFFSET
+        # activate extended ds4 reports
+        activate_ds4_extended_reports(gamepad, ds4_data_offset)
+        return ds4_data_offset
+    if op_mode == 3:
+        # report size of the device
+        return len(gamepad.read(64))
+    return None
+
+
+def load_map_phase(buttons, map_check, op_mode):
+    # Reuse a map loaded earlier this session, otherwise load it if it exists
+    # a new map will already have been created
+    if map_check[1] in loaded_button_maps:
+        buttons = loaded_button_maps[map_check[1]]
+    elif map_check[0]:
+        print("Loading Saved Button Map")
+        # Load button map for known device
+        buttons.load_button_maps(map_check[1])
+    loaded_button_maps[map_check[1]] = buttons
+
+    # Build Input Lists
+    input_list = buttons.get_set_button_names()
+    hid_input_lists = get_hidmap_input_lists(buttons, input_list) if op_mode == 3 else None
+    return buttons, input_list, hid_input_lists
+
+
+def can_warm_restart(warm_state, op_mode):
+    # pygame joysticks can only serve mode 1, hid devices can serve modes 2 and 3
+    if not warm_state:
+        return False
+    if warm_state['op_mode'] == 1:
+        return op_mode == 1
+    return op_mode in (2, 3)
+
+
+def release_warm_state(warm_state):
+    # tear down whatever a warm restart was going to reuse
+    if not warm_state:
+        return
+    if warm_state['client_socket']:
+        warm_state['client_socket'].close()
+    if warm_state['device_monitor']:
+        warm_state['device_monitor'].stop()
+
+
+def warm_connection(warm_state, op_mode):
+    # keep the live socket if the mode is unchanged, otherwise renegotiate the handshake with the same host
+    client_socket = warm_state['client_socket']
+    if client_socket and client_socket.fileno() != -1 and warm_state['op_mode'] == op_mode:
+        return client_socket
+    if client_socket:
+        client_socket.close()
+    return establish_connection(warm_state['host_address'], op_mode)
+
+
+def run_startup_phases(phases):
+    """
+    Runs independent startup phases concurrently on a small thread pool.
+
+    Args:
+        phases (dict): phase names mapped to callables taking no arguments
+
+    Returns:
+        A dict of phase names mapped to their results, exceptions are re-raised
+    """
+    timings = {}
+
+    def timed(name, func):
+        start = time.perf_counter()
+        try:
+            return func()
+        finally:
+            timings[name] = time.perf_counter() - start
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(phases)) as pool:
+        futures = {name: pool.submit(timed, name, func) for name, func in phases.items()}
+        results = {name: future.result() for name, future in futures.items()}
+    for name in phases:
+        startup_profile[f'phase {name}'] = timings[name]
+
+    print('Startup: ' + ', '.join(f'{name} {timings[name]:.3f}s' for name in phases)
+          + f', total {time.perf_counter() - start_time:.3f}s')
+    return results
+
+
+def report_stage_timings():
+    print(STAGE_TIMERS.summary())
+    if args.trace:
+        STAGE_TIMERS.write_chrome_trace(args.trace)
+        print(f"Stage trace written to {args.trace}")
+
+
+def joySender(operational_mode, auto_select, warm_state=None):
+    clock = FpsLimiter(TARGET_FPS * SPLIT_INPUT_OVERSAMPLE if args.split else TARGET_FPS)
     failed_connections = 0
     sleep_time = 0
     start_time = 0
@@ -188,10 +509,41 @@ def joySender(operational_mode, auto_select):
     map_name = None
     report_size = None
     xbox_report = XBOX_REPORT()
+    ds4_batch = None
+    hid_decoder = None
+    stick_filter = None
+    # hidraw devices read straight into one reused buffer
+    hid_buffer = bytearray(64) if args.backend == 'hidraw' else None
+    hid_reports = memoryview(hid_buffer) if hid_buffer else None
+    # forget hotkeys pressed before this run started
+    HOTKEYS.clear()
 
     ###########################################################################
-    # User or auto select gamepad and receive Operating Mode update and some device info
-    gamepad, operational_mode, vendor_id, product_id = select_device(operational_mode, auto_select)
+    # A warm restart keeps the opened device, its monitor and the host socket
+    if can_warm_restart(warm_state, operational_mode):
+        print(f'Warm restart into mode {operational_mode}')
+        gamepad, vendor_id, product_id = warm_state['gamepad'], warm_state['vendor_id'], warm_state['product_id']
+        device_monitor, device_guid = warm_state['device_monitor'], warm_state['device_guid']
+    else:
+        release_warm_state(warm_state)
+        warm_state = None
+        gamepad = None
+        # --resume reopens the last session's device once, without any interactive selection
+        if args.resume and SESSION and SESSION['op_mode'] == operational_mode and args.backend != 'fake':
+            args.resume = False
+            gamepad, vendor_id, product_id = select_session_device(SESSION)
+        if not gamepad:
+            # User or auto select gamepad and receive Operating Mode update and some device info
+            gamepad, operational_mode, vendor_id, product_id = select_device(operational_mode, auto_select)
+
+        # Watch for the device being unplugged so it can be reopened without going back through selection
+        device_monitor = device_guid = None
+        if operational_mode == 1:
+            device_guid = gamepad.get_guid()
+        elif args.backend == 'fake':
+            device_monitor = FakeHotplugMonitor()
+        else:
+            device_monitor = HidHotplugMonitor(vendor_id, product_id).start()
 
     ###########################################################################
     # Set up Button Mapping for Operating Mode
@@ -201,11 +553,6 @@ def joySender(operational_mode, auto_select):
         map_name = f'{hex(vendor_id)}{hex(product_id)}'
     elif operational_mode == 2:
         print(f'DS4 Full Motion Mode Activated')
-        # first byte is used to determine where stick input starts
-        ds4_data_offset = 3 if gamepad.read(64)[0] == 0x11 else 1
-
-        # activate extended ds4 reports
-        result = activate_ds4_extended_reports(gamepad, ds4_data_offset)
 
         # cant seem to get the writing of output reports to work through python
         '''
@@ -238,56 +585,190 @@ def joySender(operational_mode, auto_select):
     if operational_mode != 2:
         # Look for an existing map for selected device
         map_check = check_for_saved_mapping(map_name)
-        # Load map if it exists
-        if map_check[0]:
-            print("Loading Saved Button Map")
-            # Load button map for known device
-            buttons.load_button_maps(map_check[1])
-        else:
+        # Calibration baselines are cached alongside the map to speed up remapping
+        calibration_file = check_for_saved_mapping(map_name, 'cal')[1]
+        # Mapping is interactive and reads the device so it must finish before startup continues
+        if not map_check[0]:
             print("Create Button Map For Selected Device ...")
             # Create a map for all inputs
             if operational_mode == 3:
-                set_hid_mapping(gamepad, buttons, [])
+                set_hid_mapping(gamepad, buttons, [], calibration_file)
             else:
-                set_pygame_mapping(pygame, gamepad, buttons, [])
+                set_pygame_mapping(pygame, gamepad, buttons, [], calibration_file)
             # Save mapping to %APPDATA%/APP_NAME/map_name
             buttons.save_button_maps(map_check[1])
 
-        # Build Input Lists
-        input_list = buttons.get_set_button_names()
+    ###########################################################################
+    # Connect to the host, load the map and prepare the device concurrently
+    if warm_state:
+        host_address = warm_state['host_address']
+        connect = lambda: warm_connection(warm_state, operational_mode)
+    else:
+        host_address = get_host_address()
+        connect = lambda: establish_connection(host_address, operational_mode)
+    phases = {
+        'connect': connect,
+        'device': lambda: setup_device_phase(gamepad, operational_mode),
+    }
+    if operational_mode != 2:
+        phases['map'] = lambda: load_map_phase(buttons, map_check, operational_mode)
+    startup = run_startup_phases(phases)
+    if args.startup_profile:
+        print_startup_profile()
+
+    if operational_mode == 2:
+        ds4_data_offset = startup['device']
+        # reports are copied into one buffer, ds4_report views it in place and frames are sliced from it
+        ds4_buffer, ds4_report = new_ds4_report_buffer(ds4_data_offset)
+        ds4_frames = memoryview(ds4_buffer)
+        ds4_filter = DS4MotionFilter(args.motion, args.motion_rate)
+        ds4_batch = DS4ReportBatch() if args.batch else None
+    else:
+        buttons, input_list, hid_input_lists = startup['map']
+        report_size = startup['device']
         if operational_mode == 3:
-            hid_input_lists = get_hidmap_input_lists(buttons, input_list)
-            report_size = len(gamepad.read(64))
+            hid_decoder = HidDecodeCache(buttons, hid_input_lists, args.decode_lru)
+            # the noise floor comes from the calibration saved with the map
+            stick_filter = get_stick_hysteresis(buttons, hid_input_lists[0],
+                                                load_calibration(calibration_file, 'hid'), args.stick_hysteresis)
+    client_socket = startup['connect']
+    # ds4 output reports are written off the send loop's thread
+    ds4_writer = DS4OutputWriter(gamepad).start() if operational_mode == 2 else None
+    rumble = get_rumble_state(gamepad, operational_mode, ds4_writer)
+
+    # Remember this session so the next launch can --resume it, a fake device is never worth resuming
+    if client_socket and args.backend != 'fake':
+        save_session({
+            'device': get_device_fingerprint(gamepad, operational_mode, vendor_id, product_id),
+            'op_mode': operational_mode,
+            'host': host_address,
+            'port': PORT,
+            'fps': TARGET_FPS,
+        })
 
     ###########################################################################
     # Main Loop keeps client running
     # asks for new host if connection fails 3 times
     while True:
-        client_socket = establish_connection(get_host_address(), operational_mode)
+        if not client_socket:
+            host_address = get_host_address()
+            client_socket = establish_connection(host_address, operational_mode)
         loop_count = 0
+        last_frame = None
+        waiter = get_frame_waiter(gamepad, client_socket)
         while client_socket:
             # Shift+R will reset program allowing joystick reconnection/selection
             # Shift+M will remap all buttons on a hid or pygame device
             # Shift+Q will exit the program
-            if keyboard.is_pressed(RESTART) \
-                    or keyboard.is_pressed(REMAP) \
-                    or keyboard.is_pressed(QUIT):
-                client_socket.close()
+            # Shift+T toggles stage timing without leaving the loop
+            if HOTKEYS.triggered:
+                if HOTKEYS.triggered == TIMING:
+                    HOTKEYS.clear()
+                    if not STAGE_TIMERS.toggle():
+                        report_stage_timings()
+                    STAGE_TIMERS.reset()
+                    continue
+                # the socket stays open in case the restart is warm
+                if HOTKEYS.triggered != RESTART:
+                    client_socket.close()
                 break
 
+            ###################################
+            # Sleep until there is input, the host closes or a keepalive frame is due
+            if waiter:
+                host_ready, frame_due = waiter.wait()
+                if host_ready and not host_still_connected(client_socket):
+                    print("<< Connection Lost >>")
+                    client_socket.close()
+                    break
+
+            timing = STAGE_TIMERS.enabled
+            if timing:
+                STAGE_TIMERS.begin()
+
             ###################################
             # Read from Input
-            if operational_mode == 3:
-                # Read the next HID report
-                # input_report = gamepad.read(report_size)
-                # set the XBOX REPORT from HID input_report
-                get_xbox_report_from_hidmap(gamepad, report_size, buttons, hid_input_lists, xbox_report)
-            elif operational_mode == 2:
-                # Read the next HID report (64 bytes) for DS4 Passthrough
-                input_report = gamepad.read(64)
-            else:
-                # set the XBOX REPORT from PyGame inputs
-                get_xbox_report_from_pymap(pygame, gamepad, buttons, input_list, xbox_report)
+            try:
+                if operational_mode == 3:
+                    # Read the next HID report
+                    if hid_buffer:
+                        # only the newest of the queued reports matters
+                        input_report = hid_reports[:gamepad.readinto_latest(hid_buffer, HID_READ_TIMEOUT_MS)]
+                    else:
+                        input_report = gamepad.read(report_size, HID_READ_TIMEOUT_MS)
+                    device_ok = len(input_report) > 0
+                    if timing:
+                        STAGE_TIMERS.lap(STAGE_READ)
+                    # set the XBOX REPORT from HID input_report, the previous values are kept if none arrived
+                    # reports that only differ in bytes the map does not read are not decoded again
+                    if device_ok:
+                        if stick_filter:
+                            input_report = stick_filter.apply(input_report)
+                        hid_decoder.decode(input_report, xbox_report)
+                elif operational_mode == 2 and ds4_batch:
+                    # Read every HID report until the next frame is due into one batch
+                    device_ok = collect_ds4_batch(gamepad, clock, ds4_batch, ds4_buffer, ds4_frames, ds4_report,
+                                                  ds4_data_offset, ds4_filter) > 0
+                    if timing:
+                        STAGE_TIMERS.lap(STAGE_READ)
+                elif operational_mode == 2:
+                    # Read the next HID report (64 bytes) for DS4 Passthrough
+                    if hid_buffer:
+                        # read straight into the report buffer, ds4_report sees the new values in place
+                        report_length = gamepad.readinto_latest(ds4_frames[:64], HID_READ_TIMEOUT_MS)
+                    else:
+                        input_report = gamepad.read(64, HID_READ_TIMEOUT_MS)
+                        report_length = len(input_report)
+                        # the only copy of the report, ds4_report sees the new values straight away
+                        ds4_buffer[:report_length] = input_report
+                    device_ok = report_length > 0
+                    if timing:
+                        STAGE_TIMERS.lap(STAGE_READ)
+                else:
+                    pygame.event.pump()
+                    device_ok = not pygame_device_removed(pygame, gamepad)
+                    if timing:
+                        STAGE_TIMERS.lap(STAGE_READ)
+                    # set the XBOX REPORT from PyGame inputs
+                    if device_ok:
+                        get_xbox_report_from_pymap(pygame, gamepad, buttons, input_list, xbox_report, pump=False)
+                if timing:
+                    STAGE_TIMERS.lap(STAGE_DECODE)
+            except (OSError, IOError):
+                device_ok = False
+                if device_monitor:
+                    device_monitor.mark_lost()
+
+            # Reopen a lost device, its map and input lists stay loaded
+            if not device_ok and (operational_mode == 1 or not device_monitor.is_present()):
+                # the writer thread may be inside a write, it has to finish before the old device is closed
+                if ds4_writer:
+                    ds4_writer.stop()
+                gamepad = reconnect_device(gamepad, operational_mode, vendor_id, product_id,
+                                           device_guid, device_monitor)
+                if not gamepad:
+                    client_socket.close()
+                    if device_monitor:
+                        device_monitor.stop()
+                    return 0, None
+                if operational_mode == 2:
+                    ds4_writer = DS4OutputWriter(gamepad).start()
+                rumble = get_rumble_state(gamepad, operational_mode, ds4_writer)
+                if operational_mode != 1:
+                    device_setup = setup_device_phase(gamepad, operational_mode)
+                    if operational_mode == 2:
+                        ds4_data_offset = device_setup
+                        ds4_buffer, ds4_report = new_ds4_report_buffer(ds4_data_offset)
+                        ds4_frames = memoryview(ds4_buffer)
+                    else:
+                        report_size = device_setup
+                if waiter:
+                    waiter.close()
+                    waiter = get_frame_waiter(gamepad, client_socket)
+                continue
+            if operational_mode == 2 and not device_ok:
+                # no new report arrived, there is nothing to forward
+                continue
 
             ###################################
             # let's calculate some latency
@@ -297,16 +778,39 @@ def joySender(operational_mode, auto_select):
 
             ###################################
             # Send joystick input to server
+            if ds4_batch:
+                if not ds4_batch.count:
+                    # every report read was suppressed by the motion policy
+                    continue
+                frame = ds4_batch.frame()
+            elif operational_mode == 2:
+                # Shift bytearray to index of first stick value
+                frame = ds4_frames[ds4_data_offset:report_length]
+                if not ds4_filter.process(frame, ds4_report):
+                    # nothing but motion noise and counters changed, skip this round trip
+                    if not waiter:
+                        flush_HID_buffer_or_mark_lost(gamepad, clock, ds4_data_offset, device_monitor)
+                    continue
+            else:
+                frame = package_xbox_report(xbox_report)
+                if waiter and not frame_due and frame == last_frame:
+                    # unchanged input waits for the keepalive frame
+                    continue
+                last_frame = frame
+            if timing:
+                STAGE_TIMERS.lap(STAGE_PACK)
             try:
-                if operational_mode == 2:
-                    # Shift bytearray to index of first stick value
-                    client_socket.sendall(bytes(input_report)[ds4_data_offset:])
-                else:
-                    client_socket.sendall(package_xbox_report(xbox_report))
+                client_socket.sendall(frame)
             except Exception:
                 print("<< Connection Lost >>")
                 client_socket.close()
                 break
+            if waiter:
+                waiter.sent()
+            if REALTIME:
+                REALTIME.frame_sent()
+            if timing:
+                STAGE_TIMERS.lap(STAGE_SEND)
             ###################################
             # Wait for server response
             try:
@@ -315,6 +819,8 @@ def joySender(operational_mode, auto_select):
                 print(f"<< Connection Lost >>")
                 client_socket.close()
                 break
+            if timing:
+                STAGE_TIMERS.lap(STAGE_RECV)
 
             if args.latency:
                 loop_count += 1
@@ -333,46 +839,98 @@ def joySender(operational_mode, auto_select):
             ## **  Process Rumble Feedback data
             # Interpret the first two bytes or response as uint8
             left, right = struct.unpack('BB', response[:2])
-            if update_rumble('L', left) or update_rumble('R', right):
-                if operational_mode == 2:
-                    #SetDS4RumbleValue(byte(buffer[0]), byte(buffer[1]));
-                    #allGood = SendDS4Update();
-                    ds4_output_report[6] = left
-                    ds4_output_report[7] = right
-                    gamepad.write(ds4_output_report)
-
-                    pass
-                elif operational_mode == 1:
-                    pygame_rumble(gamepad, left, right)
-
-            # set clock to limit FPS
-            if operational_mode == 2:
+            # the device is only written to when the level changes or a held level is about to expire
+            if rumble:
+                rumble.update(left, right)
+            if timing:
+                STAGE_TIMERS.lap(STAGE_RUMBLE)
+
+            # collections only run in time the frame would otherwise sleep through
+            if REALTIME:
+                deadline = waiter.next_frame_time if waiter else \
+                    clock.last_frame_time + clock.target_frame_time / 1000
+                REALTIME.collect_when_idle(deadline - time.monotonic())
+
+            # set clock to limit FPS, a ds4 batch is paced by collecting the next one
+            if waiter:
+                # the next wait paces the loop
+                clock.frame_count += 1
+            elif operational_mode == 2 and not ds4_batch:
                 # flush input buffer for up-to-date reports
-                flush_HID_buffer(gamepad, clock, ds4_data_offset)
-            else:
+                flush_HID_buffer_or_mark_lost(gamepad, clock, ds4_data_offset, device_monitor)
+            elif operational_mode != 2:
                 clock.tick()
+            if timing:
+                STAGE_TIMERS.lap(STAGE_LIMITER)
+        last_socket, client_socket = client_socket, None
+        if REALTIME:
+            REALTIME.leave()
+        if waiter:
+            waiter.close()
+            if STAGE_TIMERS.enabled:
+                print(waiter.summary())
+        # nothing will update the motors until the loop runs again
+        if rumble:
+            rumble.stop()
+        # a restart or quit leaves this run, the device's output goes with it
+        if ds4_writer and HOTKEYS.triggered in (RESTART, QUIT):
+            ds4_writer.stop()
 
         # Shift+R will reset program allowing joystick reconnection/selection, holding a number will change op mode
-        if keyboard.is_pressed(RESTART):
-            while keyboard.is_pressed(RESTART):
-                pass
+        # changing mode keeps the device, maps and host socket for a warm restart
+        if HOTKEYS.triggered == RESTART:
+            wait_for_key_release(['shift', 'R'])
+            new_state = {
+                'op_mode': operational_mode,
+                'gamepad': gamepad,
+                'vendor_id': vendor_id,
+                'product_id': product_id,
+                'device_guid': device_guid,
+                'device_monitor': device_monitor,
+                'client_socket': last_socket,
+                'host_address': host_address,
+            }
             if keyboard.is_pressed('1'):
-                return 2
+                return 2, new_state
             if keyboard.is_pressed('2'):
-                return 3
+                return 3, new_state
             if keyboard.is_pressed('3'):
-                return 4
-            return 1
+                return 4, new_state
+            release_warm_state(new_state)
+            return 1, None
         # Shift+M will re-map all inputs
-        if keyboard.is_pressed(REMAP):
+        if HOTKEYS.triggered == REMAP:
+            HOTKEYS.clear()
             if operational_mode == 3:
-                set_hid_mapping(gamepad, buttons, [])
+                set_hid_mapping(gamepad, buttons, [], calibration_file)
+                # the new map may read other bytes, and calibrating again may have measured other noise
+                hid_decoder = HidDecodeCache(buttons, hid_input_lists, args.decode_lru)
+                stick_filter = get_stick_hysteresis(buttons, hid_input_lists[0],
+                                                    load_calibration(calibration_file, 'hid'), args.stick_hysteresis)
             else:
-                set_pygame_mapping(pygame, gamepad, buttons, [])
+                set_pygame_mapping(pygame, gamepad, buttons, [], calibration_file)
             buttons.save_button_maps(map_check[1])
         # Shift+Q will quit
-        if keyboard.is_pressed(QUIT):
-            return 0
+        if HOTKEYS.triggered == QUIT:
+            if device_monitor:
+                device_monitor.stop()
+            if operational_mode == 2:
+                print(ds4_filter.summary())
+                if ds4_batch:
+                    print(ds4_batch.summary())
+            if hid_decoder:
+                print(hid_decoder.summary())
+            if stick_filter:
+                print(stick_filter.summary())
+            if rumble:
+                print(rumble.summary())
+            if REALTIME:
+                print(REALTIME.summary())
+            if STAGE_TIMERS.enabled:
+                report_stage_timings()
+                if ds4_writer:
+                    print(ds4_writer.summary())
+            return 0, None
 
         ###################################
         # Connection has failed or been aborted
@@ -383,12 +941,42 @@ def joySender(operational_mode, auto_select):
 
 
 # ENTRY POINT STARTS HERE
-args = get_parsed_args()
-PORT, TARGET_FPS, OPS_MODE, AUTO_SELECT = get_arg_settings(args)
-RUN = True
-while RUN:
-    RUN = joySender(OPS_MODE, AUTO_SELECT)
-    if RUN > 1:
-        OPS_MODE = RUN - 1
-        AUTO_SELECT = False
-        wait_for_no_keyboard_input()
+# guarded so split mode's network process can import this module without starting a client
+if __name__ == '__main__':
+    args = get_parsed_args()
+    SESSION = load_session() if args.resume else None
+    if args.resume and not SESSION:
+        print("<< No saved session to resume >>")
+    if SESSION:
+        apply_session_settings(args, SESSION)
+    PORT, TARGET_FPS, OPS_MODE, AUTO_SELECT = get_arg_settings(args)
+    if args.backend == 'hidraw':
+        # every hid module user gets hidraw devices, linux only so imported here
+        from utils.hidraw_device import HidrawModule
+        hid.use(HidrawModule())
+    if args.batch and args.split:
+        print("<< --batch can not be used with --split >>")
+        sys.exit()
+    if args.epoll and (args.split or args.batch):
+        print("<< --epoll can not be used with --split or --batch >>")
+        sys.exit()
+    if args.split:
+        # linux pins only the calling thread, the input loop runs on this one and connections may be made
+        # on a startup worker thread
+        pin_to_cpu(parse_split_cpus(args.cpus)[0])
+    # hotkeys are registered once, the send loop only reads the flag they set
+    HOTKEYS = HotkeyFlags(RESTART, REMAP, QUIT, TIMING).register()
+    # stage timers live for the whole process so timings survive restarts
+    STAGE_TIMERS = StageTimers()
+    STAGE_TIMERS.enabled = args.stage_timing
+    # realtime settings also live for the whole process, the gc stays frozen across restarts
+    REALTIME = RealtimeMode(parse_realtime_cpus(args.realtime), args.sched_fifo, args.mlock) \
+        if args.realtime is not None else None
+    RUN = True
+    WARM_STATE = None
+    while RUN:
+        RUN, WARM_STATE = joySender(OPS_MODE, AUTO_SELECT, WARM_STATE)
+        if RUN > 1:
+            OPS_MODE = RUN - 1
+            AUTO_SELECT = False
+            wait_for_no_keyboard_input()
@@ -0,0 +1,274 @@
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import tracemalloc
+from array import array
+from collections import defaultdict
+from itertools import islice
+
+import JoySender
+from benchmark import canned_pygame_buttons
+from utils.gamepad_mapping import HIDButtonMapping, check_for_saved_mapping
+from utils.helper_functions import encode_string_to_hex
+from utils.hotkeys import HotkeyFlags
+from utils.fake_devices import set_fake_hid_mapping, save_capture, random_walk_hid_reports, \
+    random_walk_pygame_states, FAKE_VENDOR_ID, FAKE_PRODUCT_ID
+from utils.stage_timers import StageTimers, STAGE_NAMES, STAGE_LIMITER
+
+ALLOC_MODES = (1, 2, 3)
+ALLOC_FPS = 1000  # frames are paced by the fake device's report rate, not the limiter
+ALLOC_FAKE_RATE = 1000
+ALLOC_TOLERANCE = 0.5  # allocations per frame a stage may exceed its budget by before the check fails
+ALLOC_RELATIVE_TOLERANCE = 0.05  # and a share of its budget, how much a stage allocates depends on the input
+PEAK_TOLERANCE = 64  # bytes a stage's average peak may exceed its budget by, less than one small bytes object
+SAMPLE_EVERY = 4  # of every four frames one is counted opcode by opcode and one is traced line by line
+CAPTURE_FRAMES = 1000  # replayed in a loop, so the fake device only allocates what a real read would
+TOP_LINES = 10
+
+# allocations made by the harness and its tracing are not part of the frame
+IGNORED_FILES = [tracemalloc.__file__, __file__, sys.modules['utils.stage_timers'].__file__]
+
+
+def get_parsed_args():
+    parser = argparse.ArgumentParser(description='Count the allocations of each send loop stage per frame')
+    parser.add_argument('-f', '--frames', type=int, default=3000, help='Frames to measure per mode')
+    parser.add_argument('-w', '--warmup', type=int, default=200, help='Frames to run before measuring')
+    parser.add_argument('-m', '--mode', type=int, action='append', choices=ALLOC_MODES,
+                        help='Operational mode to measure, can be repeated, all by default')
+    parser.add_argument('-o', '--output', type=str, help='Write the measured allocations as a budget JSON file')
+    parser.add_argument('--budget', type=str, help='Fail if any stage allocates more than in this budget file')
+    return parser.parse_args()
+
+
+def run_host(port, ready):
+    # a host stand-in in its own process, so its allocations are not counted: the handshake then
+    # a two byte rumble response to every frame
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', port))
+    server.listen(1)
+    ready.set()
+    connection, _ = server.accept()
+    connection.recv(1024)
+    connection.sendall(b'ok')
+    response = bytes(2)
+    while connection.recv(4096):
+        connection.sendall(response)
+
+
+class AllocationTimers(StageTimers):
+    """
+    Stage timers that also count what each stage allocates, and quit the loop after a set number of frames.
+
+    Counted frames trace the send loop opcode by opcode and add up every rise in sys.getallocatedblocks(),
+    so blocks a stage allocates and frees again are counted too. Traced frames clear the tracemalloc traces
+    at every stage boundary instead, so the traces left at the end of a stage are the blocks it keeps alive,
+    grouped by line, and the traced peak is the most it had allocated at once.
+    """
+    def __init__(self, frames, warmup):
+        super().__init__()
+        self.enabled = True
+        self.total_frames = warmup + frames
+        self.warmup = warmup
+        self.frame = 0
+        self.sampling = None
+        self.loop_frame = None
+        # kept in arrays so storing a count does not allocate an int that outlives the opcode
+        self.block_mark = array('q', [0])
+        self.stage_blocks = array('q', [0])
+        self.allocations = [0] * len(STAGE_NAMES)
+        self.live = [0] * len(STAGE_NAMES)
+        self.peaks = [0] * len(STAGE_NAMES)
+        self.traced_frames = 0
+        self.counted_frames = 0
+        self.lines = defaultdict(int)
+        self.filters = [tracemalloc.Filter(False, filename) for filename in IGNORED_FILES]
+        self.ignored_files = set(IGNORED_FILES)
+        # one bound method for every trace call, a new one each time would itself be an allocation
+        self.trace = self._trace
+
+    def _trace(self, frame, event, arg):
+        blocks = sys.getallocatedblocks()
+        allocated = blocks - self.block_mark[0]
+        if event == 'call':
+            # a frame object is created for every traced call, the send loop itself does not make it
+            allocated -= 1
+            if frame.f_code.co_filename in self.ignored_files:
+                self.block_mark[0] = blocks - 1
+                return None
+            frame.f_trace_lines = False
+            frame.f_trace_opcodes = True
+        if allocated > 0:
+            self.stage_blocks[0] += allocated
+        self.block_mark[0] = blocks
+        return self.trace
+
+    def begin(self):
+        super().begin()
+        self.sampling = None
+        if self.frame >= self.warmup:
+            self.sampling = {0: 'blocks', 1: 'lines'}.get((self.frame - self.warmup) % SAMPLE_EVERY)
+        if self.sampling == 'lines':
+            tracemalloc.start()
+        elif self.sampling == 'blocks':
+            # the send loop is already running, its frame is traced directly and everything it calls by settrace
+            self.loop_frame = sys._getframe(1)
+            self.loop_frame.f_trace_lines = False
+            self.loop_frame.f_trace_opcodes = True
+            self.loop_frame.f_trace = self.trace
+            sys.settrace(self.trace)
+        self.stage_blocks[0] = 0
+        self.block_mark[0] = sys.getallocatedblocks()
+
+    def lap(self, stage):
+        if self.sampling == 'blocks':
+            # the opcodes since the last trace call, less the frame object of this call
+            allocated = sys.getallocatedblocks() - self.block_mark[0] - 1
+            self.allocations[stage] += self.stage_blocks[0] + max(allocated, 0)
+        elif self.sampling == 'lines':
+            peak = tracemalloc.get_traced_memory()[1]
+            snapshot = tracemalloc.take_snapshot().filter_traces(self.filters)
+            for stat in snapshot.statistics('lineno'):
+                self.live[stage] += stat.count
+                frame = stat.traceback[0]
+                self.lines[(stage, f'{frame.filename}:{frame.lineno}')] += stat.count
+            self.peaks[stage] += peak
+            del snapshot
+
+        super().lap(stage)
+        if stage == STAGE_LIMITER:
+            if self.sampling == 'lines':
+                self.traced_frames += 1
+                tracemalloc.stop()
+            elif self.sampling == 'blocks':
+                self.counted_frames += 1
+                sys.settrace(None)
+                self.loop_frame.f_trace = None
+                self.loop_frame = None
+            self.frame += 1
+            if self.frame >= self.total_frames:
+                JoySender.HOTKEYS.triggered = JoySender.QUIT
+        if tracemalloc.is_tracing():
+            # last, so the next stage's traces and peak hold none of this bookkeeping
+            tracemalloc.clear_traces()
+        self.stage_blocks[0] = 0
+        self.block_mark[0] = sys.getallocatedblocks()
+
+    def results(self):
+        traced = max(self.traced_frames, 1)
+        counted = max(self.counted_frames, 1)
+        return {STAGE_NAMES[stage]: {'allocations': round(self.allocations[stage] / counted, 2),
+                                     'live': round(self.live[stage] / traced, 2),
+                                     'peak_bytes': round(self.peaks[stage] / traced)}
+                for stage in range(len(STAGE_NAMES))}
+
+    def top_lines(self, count=TOP_LINES):
+        traced = max(self.traced_frames, 1)
+        lines = sorted(self.lines.items(), key=lambda item: -item[1])[:count]
+        return [(STAGE_NAMES[stage], line, total / traced) for (stage, line), total in lines]
+
+
+def save_fake_inputs():
+    # canned captures for the fake devices and the maps the mapping wizard would give them
+    save_capture('hid.capture', islice(random_walk_hid_reports(0), CAPTURE_FRAMES))
+    save_capture('pygame.capture', islice(random_walk_pygame_states(0), CAPTURE_FRAMES))
+    set_fake_hid_mapping(HIDButtonMapping()).save_button_maps(
+        check_for_saved_mapping(f'{hex(FAKE_VENDOR_ID)}{hex(FAKE_PRODUCT_ID)}')[1])
+    canned_pygame_buttons().save_button_maps(check_for_saved_mapping(encode_string_to_hex('Fake Joystick'))[1])
+
+
+def measure_mode(op_mode, frames, warmup, port):
+    """
+    Runs the real send loop in op_mode against a fake device and a host stand-in.
+
+    Returns:
+        The AllocationTimers of the run
+    """
+    ready = multiprocessing.Event()
+    host = multiprocessing.Process(target=run_host, args=(port, ready), daemon=True)
+    host.start()
+    ready.wait()
+
+    sys.argv = ['JoySender.py', '-n', '127.0.0.1', '-p', str(port), '-m', str(op_mode), '-f', str(ALLOC_FPS),
+                '--backend', 'fake', '--fake-rate', str(ALLOC_FAKE_RATE),
+                '--fake-source', 'capture:pygame.capture' if op_mode == 1 else 'capture:hid.capture']
+    JoySender.args = JoySender.get_parsed_args()
+    JoySender.SESSION = None
+    JoySender.REALTIME = None
+    JoySender.PORT, JoySender.TARGET_FPS, JoySender.OPS_MODE, JoySender.AUTO_SELECT = \
+        JoySender.get_arg_settings(JoySender.args)
+    # hotkeys are never registered, the timers set the quit flag themselves
+    JoySender.HOTKEYS = HotkeyFlags(JoySender.RESTART, JoySender.REMAP, JoySender.QUIT, JoySender.TIMING)
+    timers = AllocationTimers(frames, warmup)
+    JoySender.STAGE_TIMERS = timers
+    try:
+        JoySender.joySender(op_mode, False)
+    finally:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        host.terminate()
+    return timers
+
+
+def print_mode_results(op_mode, timers):
+    print(f"\nmode {op_mode}: {timers.counted_frames} counted and {timers.traced_frames} traced frames")
+    print(f"{'stage':<10}{'allocs/frame':>14}{'live/frame':>12}{'peak bytes':>12}")
+    for name, result in timers.results().items():
+        print(f"{name:<10}{result['allocations']:>14.2f}{result['live']:>12.2f}{result['peak_bytes']:>12.0f}")
+    print("top lines keeping allocations alive:")
+    for stage, line, per_frame in timers.top_lines():
+        print(f"  {per_frame:>6.2f}/frame  {stage:<8} {line}")
+
+
+def check_budget(results, budget):
+    """
+    Returns:
+        A list of the stages that allocate more or reach a higher peak per frame than their budget allows
+    """
+    failures = []
+    for mode, stages in results.items():
+        for stage, result in stages.items():
+            stage_budget = budget.get(mode, {}).get(stage, {})
+            allowed = stage_budget.get('allocations', 0)
+            if result['allocations'] > allowed * (1 + ALLOC_RELATIVE_TOLERANCE) + ALLOC_TOLERANCE:
+                failures.append(f"mode {mode} {stage}: {result['allocations']:.2f} allocations per frame, "
+                                f"budget {allowed:.2f}")
+            allowed = stage_budget.get('peak_bytes', 0)
+            if result['peak_bytes'] > allowed + PEAK_TOLERANCE:
+                failures.append(f"mode {mode} {stage}: {result['peak_bytes']:.0f} peak bytes per frame, "
+                                f"budget {allowed:.0f}")
+    return failures
+
+
+if __name__ == '__main__':
+    args = get_parsed_args()
+    output = os.path.abspath(args.output) if args.output else None
+    budget = None
+    if args.budget:
+        with open(args.budget) as f:
+            budget = json.load(f)
+    # maps and the session file are written to a scratch directory, not the working copy
+    os.chdir(tempfile.mkdtemp(prefix='joysender_alloc_'))
+    save_fake_inputs()
+
+    results = {}
+    for i, op_mode in enumerate(args.mode or ALLOC_MODES):
+        timers = measure_mode(op_mode, args.frames, args.warmup, 5090 + i)
+        results[str(op_mode)] = timers.results()
+        print_mode_results(op_mode, timers)
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nAllocations written to {args.output}")
+    if budget is not None:
+        failures = check_budget(results, budget)
+        for failure in failures:
+            print(f"<< Over budget >> {failure}")
+        if failures:
+            sys.exit(1)
+        print("\nAll stages are within their allocation budget")
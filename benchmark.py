@@ -0,0 +1,209 @@
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from utils.helper_functions import *
+from utils.gamepad_mapping import *
+import utils.gamepad_mapping as gamepad_mapping
+from utils.xbox_reports import XBOX_REPORT
+from utils.fake_devices import set_fake_hid_mapping
+from utils.ds4_reports import DS4_REPORT_EX, new_ds4_report_buffer
+
+# A DS4 style USB report in the fake device layout: sticks centred, hat neutral (0x08), no buttons or triggers
+CANNED_HID_REPORT = [0x01, 0x80, 0x7f, 0x81, 0x80, 0x08, 0x00, 0x00, 0x00, 0x00] + [0x00] * 54
+
+# input type, index, value of each pygame input, all sticks and triggers on axes
+CANNED_PYGAME_MAP = {
+    'LEFT_STICK_LEFT': (2, 0, -1), 'LEFT_STICK_RIGHT': (2, 0, 1), 'LEFT_STICK_UP': (2, 1, -1),
+    'LEFT_STICK_DOWN': (2, 1, 1), 'RIGHT_STICK_LEFT': (2, 2, -1), 'RIGHT_STICK_RIGHT': (2, 2, 1),
+    'RIGHT_STICK_UP': (2, 3, -1), 'RIGHT_STICK_DOWN': (2, 3, 1), 'LEFT_TRIGGER': (2, 4, 1), 'RIGHT_TRIGGER': (2, 5, 1),
+    'A': (1, 0, 1), 'B': (1, 1, 1), 'X': (1, 2, 1), 'Y': (1, 3, 1), 'LEFT_SHOULDER': (1, 4, 1),
+    'RIGHT_SHOULDER': (1, 5, 1), 'BACK': (1, 6, 1), 'START': (1, 7, 1), 'LEFT_THUMB': (1, 8, 1),
+    'RIGHT_THUMB': (1, 9, 1), 'GUIDE': (1, 10, 1), 'DPAD_UP': (1, 11, 1), 'DPAD_DOWN': (1, 12, 1),
+    'DPAD_LEFT': (1, 13, 1), 'DPAD_RIGHT': (1, 14, 1),
+}
+
+
+class CannedHidDevice:
+    # replays one report, enough for the decode path to run without a controller attached
+    def __init__(self, report):
+        self.report = report
+
+    def read(self, max_length, timeout_ms=0):
+        return self.report
+
+
+class CannedJoystick:
+    # a joystick with half deflected sticks and two buttons held
+    axes = [0.5, -0.25, 0.0, 0.75, -1.0, 0.3]
+    buttons = [1, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+
+    def get_axis(self, index):
+        return self.axes[index]
+
+    def get_button(self, index):
+        return self.buttons[index]
+
+    def get_hat(self, index):
+        return 0, 0
+
+
+def canned_pygame_buttons():
+    buttons = PyGameButtonMapping()
+    for name, (input_type, index, value) in CANNED_PYGAME_MAP.items():
+        getattr(buttons, name).set(input_type, index, value)
+    return buttons
+
+
+def canned_samples(num_samples=64, size=64):
+    # idle reports with a little stick noise and a free running counter, like a controller being calibrated
+    samples = []
+    for i in range(num_samples):
+        report = list(CANNED_HID_REPORT[:size])
+        report[1] = 0x80 + (i % 3) - 1
+        report[7] = i & 0xff
+        samples.append(report)
+    return samples
+
+
+def get_benchmarks():
+    """
+    Returns:
+        A dict of benchmark names mapped to callables that run one operation
+    """
+    xbox_report = XBOX_REPORT()
+    hid_device = CannedHidDevice(CANNED_HID_REPORT)
+    hid_buttons = set_fake_hid_mapping(HIDButtonMapping())
+    hid_input_lists = get_hidmap_input_lists(hid_buttons, hid_buttons.get_set_button_names())
+    joystick = CannedJoystick()
+    pygame_buttons = canned_pygame_buttons()
+    pygame_input_list = pygame_buttons.get_set_button_names()
+    packed_report = package_xbox_report(xbox_report)
+    ds4_bytes = bytes(CANNED_HID_REPORT[1:])
+    ds4_report = (c_ubyte * DS4_REPORT_SIZE)()
+    ds4_unpacked = DS4_REPORT_EX()
+    ds4_buffer, ds4_view = new_ds4_report_buffer(1)
+
+    def read_ds4_report_view():
+        # copy a report in like the mode 2 loop does, then read a field through the view
+        ds4_buffer[:len(CANNED_HID_REPORT)] = CANNED_HID_REPORT
+        return ds4_view.wGyroX
+    samples = canned_samples()
+    pressed_report = bytearray(CANNED_HID_REPORT)
+    pressed_report[5] = 0x28  # cross held
+    pressed_report[1] = 0xff  # left stick pushed right
+    baseline = bytearray(CANNED_HID_REPORT)
+    ignore_indices = list(range(10, 40))
+    stick_indices = [1, 2, 3, 4]
+    gamepad_mapping.range_baseline = bytearray(64)
+    diff = get_diff_in_bytearrays(baseline, pressed_report, ignore_indices)
+
+    return {
+        'get_xbox_report_from_hidmap':
+            lambda: get_xbox_report_from_hidmap(hid_device, 64, hid_buttons, hid_input_lists, xbox_report),
+        'get_xbox_report_from_pymap':
+            lambda: get_xbox_report_from_pymap(None, joystick, pygame_buttons, pygame_input_list, xbox_report,
+                                               pump=False),
+        'get_xbox_input_from_bytearray':
+            lambda: get_xbox_input_from_bytearray('XBOX_A', '1', CANNED_HID_REPORT, 5, 5),
+        'package_xbox_report': lambda: package_xbox_report(xbox_report),
+        'unpack_xbox_report': lambda: unpack_xbox_report(packed_report),
+        'byte_array_to_ds4_report_ex': lambda: byte_array_to_ds4_report_ex(ds4_bytes, ds4_report),
+        'unpack_ds4_report_ex': lambda: unpack_ds4_report_ex(ds4_bytes, ds4_unpacked),
+        'ds4_report_view': read_ds4_report_view,
+        'get_report_statistics': lambda: get_report_statistics(samples, 64),
+        'get_diff_in_bytearrays': lambda: get_diff_in_bytearrays(baseline, pressed_report, ignore_indices),
+        'filter_hid_stick_gitter': lambda: filter_hid_stick_gitter(diff, stick_indices),
+        'get_bits_different': lambda: get_bits_different(0x08, 0x28),
+    }
+
+
+def time_benchmark(func, min_time=.2, repeats=5):
+    """
+    Times a callable, calibrating the loop count so each repeat runs for at least min_time seconds.
+
+    Returns:
+        The best nanoseconds per operation over all repeats
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter_ns()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter_ns() - start
+        if elapsed >= min_time * 1e9:
+            break
+        loops *= 2 if elapsed < min_time * 1e8 else 10
+
+    best = elapsed / loops
+    for _ in range(repeats - 1):
+        start = time.perf_counter_ns()
+        for _ in range(loops):
+            func()
+        best = min(best, (time.perf_counter_ns() - start) / loops)
+    return best
+
+
+def get_git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(name_filter=None, min_time=.2, repeats=5):
+    results = {}
+    print(f"{'benchmark':<32}{'ops/sec':>14}{'ns/frame':>12}")
+    for name, func in get_benchmarks().items():
+        if name_filter and name_filter not in name:
+            continue
+        ns = time_benchmark(func, min_time, repeats)
+        results[name] = ns
+        print(f"{name:<32}{1e9 / ns:>14,.0f}{ns:>12,.0f}")
+    return {
+        'revision': get_git_revision(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'timestamp': time.time(),
+        'ns_per_op': results,
+    }
+
+
+def compare_results(baseline_file, candidate_file):
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    with open(candidate_file) as f:
+        candidate = json.load(f)
+    print(f"{'benchmark':<32}{'baseline ns':>12}{'candidate ns':>14}{'change':>9}")
+    for name, base_ns in baseline['ns_per_op'].items():
+        if name not in candidate['ns_per_op']:
+            continue
+        cand_ns = candidate['ns_per_op'][name]
+        print(f"{name:<32}{base_ns:>12,.0f}{cand_ns:>14,.0f}{(cand_ns - base_ns) / base_ns * 100:>+8.1f}%")
+
+
+def get_parsed_args():
+    parser = argparse.ArgumentParser(description='Microbenchmarks for the per-frame code paths')
+    parser.add_argument('-o', '--output', type=str, help='Write the results to this JSON file')
+    parser.add_argument('-k', '--filter', type=str, help='Only run benchmarks whose name contains this')
+    parser.add_argument('--min-time', type=float, default=.2, help='Minimum seconds per timing repeat')
+    parser.add_argument('--repeats', type=int, default=5, help='Timing repeats, the best is kept')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CANDIDATE'),
+                        help='Compare two result files instead of running')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_parsed_args()
+    if args.compare:
+        compare_results(*args.compare)
+        sys.exit()
+    results = run_benchmarks(args.filter, args.min_time, args.repeats)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
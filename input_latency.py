@@ -0,0 +1,89 @@
+import argparse
+import time
+
+from utils.evdev_input import EvdevPygame
+from utils.stage_timers import percentile
+
+POLL_INTERVAL = .00025  # both paths are polled at the same rate, this bounds the resolution
+
+
+def get_parsed_args():
+    parser = argparse.ArgumentParser(
+        description='Compare how soon button presses reach the evdev and pygame joystick paths (Linux only)')
+    parser.add_argument('-i', '--index', type=int, default=0, help='pygame index of the joystick to test')
+    parser.add_argument('-d', '--duration', type=float, default=20, help='Seconds to keep pressing buttons for')
+    return parser.parse_args()
+
+
+def pressed_count(joystick):
+    return sum(joystick.get_button(i) for i in range(joystick.get_numbuttons()))
+
+
+def measure(pygame, pygame_joystick, evdev, evdev_joystick, duration):
+    """
+    Polls the same device through pygame and evdev. Each change in the number of held buttons is timed
+    from the kernel's event timestamp until each path shows it.
+
+    Returns:
+        Sorted evdev and pygame latencies in seconds
+    """
+    evdev_latencies = []
+    pygame_latencies = []
+    evdev_pressed = pressed_count(evdev_joystick)
+    pygame_pressed = pressed_count(pygame_joystick)
+    changes = []  # kernel times of button changes pygame has not shown yet, oldest first
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        evdev.event.pump()
+        now = time.monotonic()
+        pressed = pressed_count(evdev_joystick)
+        if pressed != evdev_pressed:
+            evdev_pressed = pressed
+            evdev_latencies.append(now - evdev_joystick.last_event_time)
+            changes.append((evdev_joystick.last_event_time, pressed))
+
+        pygame.event.pump()
+        now = time.monotonic()
+        pressed = pressed_count(pygame_joystick)
+        if pressed != pygame_pressed:
+            pygame_pressed = pressed
+            # match the oldest evdev change that ended in the same state
+            for i, (event_time, count) in enumerate(changes):
+                if count == pressed:
+                    pygame_latencies.append(now - event_time)
+                    del changes[:i + 1]
+                    break
+        time.sleep(POLL_INTERVAL)
+    return sorted(evdev_latencies), sorted(pygame_latencies)
+
+
+def print_latencies(name, latencies):
+    if not latencies:
+        print(f"{name:<8}no button changes seen")
+        return
+    print(f"{name:<8}{len(latencies):>6}{percentile(latencies, 50) * 1000:>10.3f}"
+          f"{percentile(latencies, 90) * 1000:>10.3f}{percentile(latencies, 99) * 1000:>10.3f}"
+          f"{latencies[-1] * 1000:>10.3f}")
+
+
+if __name__ == '__main__':
+    import pygame
+    args = get_parsed_args()
+    pygame.display.init()
+    pygame.joystick.init()
+    pygame_joystick = pygame.joystick.Joystick(args.index)
+    pygame_joystick.init()
+
+    # the evdev device with the same name, evdev devices can be read by several readers at once
+    evdev = EvdevPygame()
+    matches = [i for i in range(evdev.joystick.get_count())
+               if evdev.joystick.capabilities[evdev.joystick.paths[i]]['name'] == pygame_joystick.get_name()]
+    if not matches:
+        raise SystemExit(f"No readable evdev device named '{pygame_joystick.get_name()}'")
+    evdev_joystick = evdev.joystick.Joystick(matches[0])
+
+    print(f"Press and release buttons on '{pygame_joystick.get_name()}' for {args.duration}s ...")
+    evdev_latencies, pygame_latencies = measure(pygame, pygame_joystick, evdev, evdev_joystick, args.duration)
+    print(f"{'path':<8}{'count':>6}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}   (ms from kernel event)")
+    print_latencies('evdev', evdev_latencies)
+    print_latencies('pygame', pygame_latencies)
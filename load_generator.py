@@ -0,0 +1,167 @@
+import argparse
+import asyncio
+import multiprocessing
+import time
+
+from utils.helper_functions import package_xbox_report, get_hidmap_input_lists
+from utils.gamepad_mapping import HIDButtonMapping, decode_xbox_report_from_hidmap
+from utils.fake_devices import random_walk_hid_reports, set_fake_hid_mapping
+from utils.stage_timers import percentile
+from utils.ds4_reports import DS4MotionFilter, DS4_MOTION_POLICIES, DS4_MOTION_RATE, new_ds4_report_buffer
+from utils.xbox_reports import XBOX_REPORT
+
+DS4_DATA_OFFSET = 1  # virtual DS4s report like a USB connected controller
+
+
+def get_parsed_args():
+    parser = argparse.ArgumentParser(description='Drive a JoySender host with many virtual controllers')
+    parser.add_argument('-n', '--host', type=str, default='127.0.0.1', help='IP address of host/server')
+    parser.add_argument('-p', '--port', type=int, default=5000, help='Port that the host/server is listening on')
+    parser.add_argument('-c', '--controllers', type=int, default=10, help='Number of virtual controllers')
+    parser.add_argument('-f', '--fps', type=int, default=250, help='Frames per second sent by each controller')
+    parser.add_argument('-m', '--mode', type=int, default=3,
+                        help='Operational Mode sent in the handshake: 1 or 3: xbox reports, 2: ds4 passthrough')
+    parser.add_argument('-d', '--duration', type=float, default=10, help='Seconds each controller sends for')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Processes to shard the controllers across, each runs its own event loop')
+    parser.add_argument('--motion', choices=DS4_MOTION_POLICIES, default='full',
+                        help='DS4 passthrough motion policy, mode 2 only')
+    parser.add_argument('--motion-rate', type=int, default=DS4_MOTION_RATE,
+                        help='Motion updates per second with --motion decimate')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first controller\'s random walk')
+    return parser.parse_args()
+
+
+def get_frame_encoder(op_mode, seed, motion='full', motion_rate=DS4_MOTION_RATE):
+    """
+    Returns:
+        A callable producing the next frame of a virtual controller encoded as JoySender would send it,
+        or None when JoySender would suppress it
+    """
+    reports = random_walk_hid_reports(seed)
+    if op_mode == 2:
+        # DS4 passthrough forwards the report from the first stick byte, after the motion policy
+        buffer, ds4_report = new_ds4_report_buffer(DS4_DATA_OFFSET)
+        frames = memoryview(buffer)
+        ds4_filter = DS4MotionFilter(motion, motion_rate)
+
+        def passthrough():
+            report = next(reports)
+            buffer[:len(report)] = report
+            frame = frames[DS4_DATA_OFFSET:len(report)]
+            return frame if ds4_filter.process(frame, ds4_report) else None
+        return passthrough
+
+    buttons = set_fake_hid_mapping(HIDButtonMapping())
+    input_lists = get_hidmap_input_lists(buttons, buttons.get_set_button_names())
+    xbox_report = XBOX_REPORT()
+
+    def encode():
+        decode_xbox_report_from_hidmap(next(reports), buttons, input_lists, xbox_report)
+        return package_xbox_report(xbox_report)
+    return encode
+
+
+async def run_controller(host, port, fps, op_mode, duration, seed, rtts, motion, motion_rate):
+    # one virtual controller: the JoySender handshake, then paced frame and response round trips
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(str(f'{fps}:{op_mode}').encode())
+        await writer.drain()
+        await reader.read(1024)
+
+        encode = get_frame_encoder(op_mode, seed, motion, motion_rate)
+        period = 1 / fps
+        frames = suppressed = bytes_sent = 0
+        start = next_frame = time.perf_counter()
+        while next_frame - start < duration:
+            frame = encode()
+            if frame is None:
+                suppressed += 1
+            else:
+                sent = time.perf_counter()
+                writer.write(frame)
+                await writer.drain()
+                if not await reader.read(1024):
+                    break
+                rtts.append(time.perf_counter() - sent)
+                frames += 1
+                bytes_sent += len(frame)
+            # keep the schedule, a late frame is sent straight away
+            next_frame += period
+            delay = next_frame - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                next_frame = time.perf_counter()
+        return frames, suppressed, bytes_sent
+    finally:
+        writer.close()
+
+
+async def run_controllers(host, port, fps, op_mode, duration, seeds, motion, motion_rate):
+    rtts = []
+    results = await asyncio.gather(*(run_controller(host, port, fps, op_mode, duration, seed, rtts,
+                                                    motion, motion_rate)
+                                     for seed in seeds), return_exceptions=True)
+    counts = [result for result in results if isinstance(result, tuple)]
+    frames = sum(count[0] for count in counts)
+    suppressed = sum(count[1] for count in counts)
+    bytes_sent = sum(count[2] for count in counts)
+    failed = len(results) - len(counts)
+    return frames, suppressed, bytes_sent, failed, rtts
+
+
+def run_shard(host, port, fps, op_mode, duration, seeds, motion='full', motion_rate=DS4_MOTION_RATE):
+    """
+    Runs a shard of controllers on one event loop.
+
+    Returns:
+        A tuple of frames sent, frames suppressed, bytes sent, failed controllers, round trip times
+        and the CPU seconds used
+    """
+    cpu_start = time.process_time()
+    results = asyncio.run(run_controllers(host, port, fps, op_mode, duration, seeds, motion, motion_rate))
+    return results + (time.process_time() - cpu_start,)
+
+
+def run_load(host, port, controllers, fps, op_mode, duration, workers, first_seed=0,
+             motion='full', motion_rate=DS4_MOTION_RATE):
+    seeds = list(range(first_seed, first_seed + controllers))
+    shards = [(host, port, fps, op_mode, duration, seeds[i::workers], motion, motion_rate) for i in range(workers)]
+    start = time.perf_counter()
+    if workers == 1:
+        results = [run_shard(*shards[0])]
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.starmap(run_shard, shards)
+    elapsed = time.perf_counter() - start
+
+    frames = sum(result[0] for result in results)
+    suppressed = sum(result[1] for result in results)
+    bytes_sent = sum(result[2] for result in results)
+    failed = sum(result[3] for result in results)
+    rtts = sorted(rtt for result in results for rtt in result[4])
+    cpu = sum(result[5] for result in results)
+    return frames, suppressed, bytes_sent, failed, rtts, cpu, elapsed
+
+
+def print_load_report(controllers, fps, frames, suppressed, bytes_sent, failed, rtts, cpu, elapsed):
+    print(f"controllers: {controllers - failed}/{controllers} connected at {fps} fps")
+    print(f"frames/s:    {frames / elapsed:,.0f} of {(controllers - failed) * fps:,} targeted, "
+          f"{suppressed / elapsed:,.0f} suppressed")
+    print(f"bandwidth:   {bytes_sent / elapsed / 1000:,.1f} kB/s of frame payload")
+    if rtts:
+        print(f"rtt ms:      p50 {percentile(rtts, 50) * 1000:.3f}  p90 {percentile(rtts, 90) * 1000:.3f}  "
+              f"p99 {percentile(rtts, 99) * 1000:.3f}  max {rtts[-1] * 1000:.3f}")
+    if controllers > failed:
+        print(f"client cpu:  {cpu / elapsed / (controllers - failed) * 100:.2f}% per controller")
+
+
+if __name__ == '__main__':
+    args = get_parsed_args()
+    print(f"Starting {args.controllers} controllers on {args.workers} event loop(s) "
+          f"against {args.host}:{args.port} for {args.duration}s ...")
+    results = run_load(args.host, args.port, args.controllers, args.fps, args.mode,
+                       args.duration, args.workers, args.seed, args.motion, args.motion_rate)
+    print_load_report(args.controllers, args.fps, *results)
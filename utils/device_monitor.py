@@ -0,0 +1,103 @@
+import threading
+
+from .helper_functions import hid, wait_ms
+
+HOTPLUG_POLL_INTERVAL = 1.0  # seconds between hid enumeration checks
+
+
+def enumerate_hid_devices():
+    """
+    Takes one snapshot of the attached HID devices.
+
+    Returns:
+        A list of device info dicts, callers should copy it before modifying it.
+    """
+    return hid.enumerate()
+
+
+class HidHotplugMonitor:
+    """
+    Polls hid enumeration on a background thread to detect a device disappearing or reappearing.
+    """
+    def __init__(self, vendor_id, product_id, interval=HOTPLUG_POLL_INTERVAL):
+        self.vendor_id = vendor_id
+        self.product_id = product_id
+        self.interval = interval
+        self.present = threading.Event()
+        self.present.set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def is_present(self):
+        return self.present.is_set()
+
+    def mark_lost(self):
+        # called when a read fails before the next enumeration notices the device is gone
+        self.present.clear()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                found = len(hid.enumerate(self.vendor_id, self.product_id)) > 0
+            except Exception:
+                found = False
+            if found:
+                self.present.set()
+            else:
+                self.present.clear()
+
+
+def wait_for_hid_device(vendor_id, product_id, monitor, abort):
+    """
+    Blocks until the monitored device reappears and reopens it.
+
+    Args:
+        abort (callable): returns True when the user gives up waiting
+
+    Returns:
+        The reopened hid.device, or None if aborted
+    """
+    while not abort():
+        if not monitor.present.wait(monitor.interval):
+            continue
+        device = hid.device()
+        try:
+            device.open(vendor_id, product_id)
+            return device
+        except (OSError, IOError):
+            # enumeration can briefly list a device that cannot be opened yet
+            monitor.mark_lost()
+    return None
+
+
+def pygame_device_removed(pygame, gamepad) -> bool:
+    # the event queue must already have been pumped this frame
+    for event in pygame.event.get(pygame.JOYDEVICEREMOVED):
+        if event.instance_id == gamepad.get_instance_id():
+            return True
+    return False
+
+
+def wait_for_pygame_device(pygame, guid, abort):
+    """
+    Blocks until a joystick with the given guid is added again and opens it.
+
+    Returns:
+        The reopened pygame joystick, or None if aborted
+    """
+    while not abort():
+        pygame.event.pump()
+        for event in pygame.event.get(pygame.JOYDEVICEADDED):
+            joystick = pygame.joystick.Joystick(event.device_index)
+            if joystick.get_guid() == guid:
+                joystick.init()
+                return joystick
+        wait_ms(100)
+    return None
@@ -0,0 +1,76 @@
+import threading
+
+from .helper_functions import ds4_output_report
+
+DS4_RUMBLE_OFFSET = 6  # left then right motor
+DS4_LIGHTBAR_OFFSET = 8  # red, green, blue
+
+
+class DS4OutputWriter:
+    """
+    Writes DS4 output reports on its own thread so a slow write never holds up the send loop.
+
+    Rumble and lightbar updates go into a one-slot mailbox holding the latest output state,
+    the writer thread builds the report in a reused bytearray and skips writes that would
+    repeat the last report written.
+    """
+    def __init__(self, gamepad, template=ds4_output_report):
+        self.gamepad = gamepad
+        self.report = bytearray(template)
+        self.state = list(self.report[DS4_RUMBLE_OFFSET:DS4_LIGHTBAR_OFFSET + 3])
+        self.written_state = None
+        self.pending = False
+        self.stopped = False
+        self.writes = 0
+        self.coalesced = 0
+        self.errors = 0
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _post(self, offset, values):
+        with self._condition:
+            self.state[offset:offset + len(values)] = values
+            self.pending = True
+            self._condition.notify()
+
+    def set_rumble(self, left, right):
+        self._post(0, (left, right))
+
+    def set_lightbar(self, red, green, blue):
+        self._post(DS4_LIGHTBAR_OFFSET - DS4_RUMBLE_OFFSET, (red, green, blue))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self.pending and not self.stopped:
+                    self._condition.wait()
+                if not self.pending:
+                    return
+                state = tuple(self.state)
+                self.pending = False
+            if state == self.written_state:
+                self.coalesced += 1
+                continue
+            self.report[DS4_RUMBLE_OFFSET:DS4_LIGHTBAR_OFFSET + 3] = state
+            try:
+                self.gamepad.write(self.report)
+            except (OSError, IOError, ValueError):
+                # a lost device is noticed and reopened by the read side
+                self.errors += 1
+                continue
+            self.written_state = state
+            self.writes += 1
+
+    def stop(self):
+        # the last posted state is still written before the thread exits
+        with self._condition:
+            self.stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    def summary(self):
+        return f"DS4 output reports: {self.writes} written, {self.coalesced} coalesced, {self.errors} failed"
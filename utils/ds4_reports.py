@@ -0,0 +1,237 @@
+import struct
+import time
+from ctypes import *
+
+DS4_USB_DATA_OFFSET = 1  # usb input reports (0x01) start with the report id
+DS4_BT_DATA_OFFSET = 3  # bluetooth input reports (0x11) have two more header bytes
+DS4_MOTION_POLICIES = ('full', 'decimate', 'zero')
+DS4_MOTION_RATE = 50  # motion updates per second when decimating
+DS4_KEEPALIVE_MS = 250  # an unchanged frame is still sent this often so the host keeps hearing from us
+DS4_BATCH_MAX_REPORTS = 32  # reports one batched frame holds, the oldest are dropped beyond this
+
+
+class DS4_TOUCH(Structure):
+    """
+    One touchpad packet of a DS4 report.
+    """
+    _pack_ = 1
+    _fields_ = [("bPacketCounter", c_ubyte),
+                ("bIsUpTrackingNum1", c_ubyte),
+                ("bTouchData1", c_ubyte * 3),
+                ("bIsUpTrackingNum2", c_ubyte),
+                ("bTouchData2", c_ubyte * 3)]
+
+
+class DS4_REPORT_EX(Structure):
+    """
+    Represents the DS4 input report from the first stick byte on, the layout ViGEm's DS4_REPORT_EX uses.
+    """
+    _pack_ = 1
+    _fields_ = [("bThumbLX", c_ubyte),
+                ("bThumbLY", c_ubyte),
+                ("bThumbRX", c_ubyte),
+                ("bThumbRY", c_ubyte),
+                ("wButtons", c_ushort),
+                ("bSpecial", c_ubyte),
+                ("bTriggerL", c_ubyte),
+                ("bTriggerR", c_ubyte),
+                ("wTimestamp", c_ushort),
+                ("bBatteryLvl", c_ubyte),
+                ("wGyroX", c_short),
+                ("wGyroY", c_short),
+                ("wGyroZ", c_short),
+                ("wAccelX", c_short),
+                ("wAccelY", c_short),
+                ("wAccelZ", c_short),
+                ("_bUnknown1", c_ubyte * 5),
+                ("bBatteryLvlSpecial", c_ubyte),
+                ("_bUnknown2", c_ubyte * 2),
+                ("bTouchPacketsN", c_ubyte),
+                ("sCurrentTouch", DS4_TOUCH),
+                ("sPreviousTouch", DS4_TOUCH * 2),
+                ("_bPadding", c_ubyte * 3)]
+
+
+def new_ds4_report_buffer(data_offset, report_size=64):
+    """
+    Allocates a reusable input report buffer with a DS4_REPORT_EX view mapped over it at data_offset.
+    Copying each report into the buffer updates the view without creating any new objects.
+
+    Args:
+        data_offset (int): the first stick byte, DS4_USB_DATA_OFFSET or DS4_BT_DATA_OFFSET
+        report_size (int): the largest report that will be copied in
+
+    Returns:
+        A tuple of the bytearray and the DS4_REPORT_EX view over it
+    """
+    # a short bluetooth read still leaves room for the whole view, the tail just stays zeroed
+    buffer = bytearray(max(report_size, data_offset + sizeof(DS4_REPORT_EX)))
+    return buffer, DS4_REPORT_EX.from_buffer(buffer, data_offset)
+
+
+def print_ds4_report(report: DS4_REPORT_EX) -> None:
+    print(f"Sticks: {report.bThumbLX} {report.bThumbLY} {report.bThumbRX} {report.bThumbRY}")
+    print(f"wButtons: {report.wButtons:#06x} bSpecial: {report.bSpecial:#04x}")
+    print(f"Triggers: {report.bTriggerL} {report.bTriggerR}")
+    print(f"wTimestamp: {report.wTimestamp}")
+    print(f"Gyro: {report.wGyroX} {report.wGyroY} {report.wGyroZ}")
+    print(f"Accel: {report.wAccelX} {report.wAccelY} {report.wAccelZ}")
+
+
+# the bytes between these change on every report, change detection compares around them
+DS4_TIMESTAMP_OFFSET = DS4_REPORT_EX.wTimestamp.offset
+DS4_TIMESTAMP_END = DS4_TIMESTAMP_OFFSET + sizeof(c_ushort)
+DS4_SPECIAL_OFFSET = DS4_REPORT_EX.bSpecial.offset
+DS4_SPECIAL_BUTTONS = 0x03  # ps and touchpad click, the upper six bits of bSpecial count reports
+DS4_NO_MOTION = (0, 0, 0, 0, 0, 0)
+
+
+def set_ds4_motion(report: DS4_REPORT_EX, motion):
+    # gyro x, y, z then accel x, y, z
+    report.wGyroX, report.wGyroY, report.wGyroZ, report.wAccelX, report.wAccelY, report.wAccelZ = motion
+
+
+class DS4MotionFilter:
+    """
+    Applies a motion policy to DS4 passthrough frames and suppresses frames that carry nothing new.
+
+    'full' forwards motion untouched, 'decimate' replaces it with its average over each 1/rate_hz window
+    and 'zero' clears it. Under 'decimate' and 'zero' a frame that only differs from the last sent one
+    in its timestamp and report counter is suppressed, at most for DS4_KEEPALIVE_MS.
+    Motion and bSpecial are read and written through the DS4_REPORT_EX view over the frame's buffer.
+    """
+    def __init__(self, policy='full', rate_hz=DS4_MOTION_RATE, keepalive_ms=DS4_KEEPALIVE_MS):
+        if policy not in DS4_MOTION_POLICIES:
+            raise ValueError(f"unknown motion policy '{policy}'")
+        self.policy = policy
+        self.period = 1 / rate_hz
+        self.keepalive = keepalive_ms / 1000
+        self.motion_sums = [0] * 6
+        self.motion_samples = 0
+        self.motion = DS4_NO_MOTION
+        self.next_motion_time = 0.0
+        self.last_frame = bytearray()
+        self.last_special = 0
+        self.last_send_time = 0.0
+        self.start_time = None
+        self.frames_sent = 0
+        self.frames_suppressed = 0
+        self.bytes_sent = 0
+
+    def _decimate(self, report, now):
+        sums = self.motion_sums
+        sums[0] += report.wGyroX
+        sums[1] += report.wGyroY
+        sums[2] += report.wGyroZ
+        sums[3] += report.wAccelX
+        sums[4] += report.wAccelY
+        sums[5] += report.wAccelZ
+        self.motion_samples += 1
+        if now >= self.next_motion_time:
+            self.motion = tuple(total // self.motion_samples for total in sums)
+            self.motion_sums = [0] * 6
+            self.motion_samples = 0
+            self.next_motion_time = max(self.next_motion_time + self.period, now)
+        set_ds4_motion(report, self.motion)
+
+    def _repeats_last_frame(self, frame, report):
+        # equal apart from the bytes that change on every report
+        last = self.last_frame
+        return len(frame) == len(last) \
+            and frame[:DS4_SPECIAL_OFFSET] == last[:DS4_SPECIAL_OFFSET] \
+            and not (report.bSpecial ^ self.last_special) & DS4_SPECIAL_BUTTONS \
+            and frame[DS4_SPECIAL_OFFSET + 1:DS4_TIMESTAMP_OFFSET] == last[DS4_SPECIAL_OFFSET + 1:DS4_TIMESTAMP_OFFSET] \
+            and frame[DS4_TIMESTAMP_END:] == last[DS4_TIMESTAMP_END:]
+
+    def process(self, frame, report):
+        """
+        Applies the motion policy to a writable frame in place.
+
+        Args:
+            frame: the report from the first stick byte on
+            report (DS4_REPORT_EX): the view over the same bytes, see new_ds4_report_buffer()
+
+        Returns:
+            True if the frame should be sent, False if it can be suppressed
+        """
+        now = time.monotonic()
+        if self.start_time is None:
+            self.start_time = now
+        if self.policy == 'zero':
+            set_ds4_motion(report, DS4_NO_MOTION)
+        elif self.policy == 'decimate':
+            self._decimate(report, now)
+
+        if self.policy != 'full' and now - self.last_send_time < self.keepalive \
+                and self._repeats_last_frame(frame, report):
+            self.frames_suppressed += 1
+            return False
+
+        if self.policy != 'full':
+            self.last_frame[:] = frame
+            self.last_special = report.bSpecial
+        self.last_send_time = now
+        self.frames_sent += 1
+        self.bytes_sent += len(frame)
+        return True
+
+    def summary(self):
+        elapsed = time.monotonic() - self.start_time if self.start_time is not None else 0
+        rate = self.bytes_sent / elapsed if elapsed else 0
+        return (f"DS4 motion '{self.policy}': {self.frames_sent} frames sent, {self.frames_suppressed} suppressed, "
+                f"{rate / 1000:.2f} kB/s")
+
+
+# batched frame: payload length after this header field, report count, then each report with its timestamp
+DS4_BATCH_HEADER = struct.Struct('<HB')
+DS4_BATCH_TIMESTAMP = struct.Struct('<I')  # microseconds on the client's monotonic clock, wrapping
+
+
+class DS4ReportBatch:
+    """
+    Collects every DS4 report read between two sends into one length-prefixed network frame.
+
+    Each entry is a 32-bit microsecond receive timestamp followed by report_length report bytes,
+    a shorter report is zero padded. The frame is built in one reused bytearray.
+    """
+    def __init__(self, report_length=sizeof(DS4_REPORT_EX), max_reports=DS4_BATCH_MAX_REPORTS):
+        self.report_length = report_length
+        self.entry_size = DS4_BATCH_TIMESTAMP.size + report_length
+        self.max_reports = max_reports
+        self.buffer = bytearray(DS4_BATCH_HEADER.size + max_reports * self.entry_size)
+        self.view = memoryview(self.buffer)
+        self.count = 0
+        self.dropped = 0
+
+    def clear(self):
+        self.count = 0
+
+    def add(self, report, timestamp_us):
+        if self.count == self.max_reports:
+            # keep the newest reports, a batch this long means the host is far behind anyway
+            start = DS4_BATCH_HEADER.size
+            self.buffer[start:start + (self.count - 1) * self.entry_size] = \
+                self.view[start + self.entry_size:start + self.count * self.entry_size]
+            self.count -= 1
+            self.dropped += 1
+        offset = DS4_BATCH_HEADER.size + self.count * self.entry_size
+        DS4_BATCH_TIMESTAMP.pack_into(self.buffer, offset, timestamp_us & 0xFFFFFFFF)
+        offset += DS4_BATCH_TIMESTAMP.size
+        length = min(len(report), self.report_length)
+        self.buffer[offset:offset + length] = report[:length]
+        if length < self.report_length:
+            self.buffer[offset + length:offset + self.report_length] = bytes(self.report_length - length)
+        self.count += 1
+
+    def frame(self):
+        """
+        Returns:
+            A memoryview of the batched frame, valid until the batch is next changed
+        """
+        size = DS4_BATCH_HEADER.size + self.count * self.entry_size
+        # the length field counts the report count byte and every entry after it
+        DS4_BATCH_HEADER.pack_into(self.buffer, 0, size - DS4_BATCH_HEADER.size + 1, self.count)
+        return self.view[:size]
+
+    def summary(self):
+        return f"DS4 batches: {self.dropped} reports dropped from full batches"
@@ -0,0 +1,448 @@
+import fcntl
+import glob
+import os
+import pickle
+import struct
+import time
+from types import SimpleNamespace
+
+# struct input_event: timeval seconds and microseconds, type, code, value
+INPUT_EVENT = struct.Struct('llHHi')
+# struct input_absinfo: value, minimum, maximum, fuzz, flat, resolution
+INPUT_ABSINFO = struct.Struct('6i')
+# struct ff_effect holding an ff_rumble_effect: type, id, direction, trigger, replay, then the union
+FF_RUMBLE_EFFECT = struct.Struct('HhHHHHH2xHH28x')
+
+EVDEV_READ_EVENTS = 64  # input events taken per read
+EVDEV_PATHS = '/dev/input/event*'
+
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_ABS = 0x03
+EV_FF = 0x15
+SYN_REPORT = 0
+SYN_DROPPED = 3
+ABS_HAT0X = 0x10
+ABS_HAT3Y = 0x17
+ABS_CNT = 0x40
+KEY_CNT = 0x300
+BTN_MISC = 0x100
+BTN_MOUSE = 0x110
+BTN_JOYSTICK = 0x120
+BTN_THUMBR = 0x13e
+BTN_TOOL_PEN = 0x140
+BTN_TOOL_FINGER = 0x145
+BTN_STYLUS = 0x14b
+INPUT_PROP_POINTER = 0x00
+INPUT_PROP_DIRECT = 0x01
+INPUT_PROP_ACCELEROMETER = 0x06
+INPUT_PROP_CNT = 0x20
+FF_RUMBLE = 0x50
+CLOCK_MONOTONIC = 1
+
+# pygame's joystick hotplug event types
+JOYDEVICEADDED = 1541
+JOYDEVICEREMOVED = 1542
+
+
+def _ioc(direction, number, size):
+    # linux _IOC() for the 'E' evdev ioctls
+    return direction << 30 | size << 16 | ord('E') << 8 | number
+
+
+def _ior(number, size):
+    return _ioc(2, number, size)
+
+
+def _iow(number, size):
+    return _ioc(1, number, size)
+
+
+EVIOCGID = _ior(0x02, 8)
+EVIOCGPROP = _ior(0x09, INPUT_PROP_CNT // 8)
+EVIOCGKEY = _ior(0x18, KEY_CNT // 8)
+EVIOCSFF = _iow(0x80, FF_RUMBLE_EFFECT.size)
+EVIOCSCLOCKID = _iow(0xa0, 4)
+
+
+def EVIOCGNAME(length):
+    return _ior(0x06, length)
+
+
+def EVIOCGBIT(event_type, length):
+    return _ior(0x20 + event_type, length)
+
+
+def EVIOCGABS(code):
+    return _ior(0x40 + code, INPUT_ABSINFO.size)
+
+
+def _bits(fd, request, length):
+    # the set bit numbers of an evdev bitmask
+    mask = fcntl.ioctl(fd, request, bytes(length))
+    return [byte * 8 + bit for byte in range(length) for bit in range(8) if mask[byte] >> bit & 1]
+
+
+def query_capabilities(fd):
+    """
+    Reads what an evdev device reports through its ioctls.
+
+    Returns:
+        A dictionary of the device name, its (bus, vendor, product, version) id, the minimum and maximum
+        of each absolute axis code, its key codes, its input properties and whether it supports rumble
+    """
+    name = fcntl.ioctl(fd, EVIOCGNAME(256), bytes(256)).split(b'\0', 1)[0].decode(errors='replace')
+    device_id = struct.unpack('4H', fcntl.ioctl(fd, EVIOCGID, bytes(8)))
+    events = _bits(fd, EVIOCGBIT(0, 4), 4)
+    absolute = {}
+    if EV_ABS in events:
+        for code in _bits(fd, EVIOCGBIT(EV_ABS, ABS_CNT // 8), ABS_CNT // 8):
+            _, minimum, maximum, _, _, _ = INPUT_ABSINFO.unpack(fcntl.ioctl(fd, EVIOCGABS(code), bytes(24)))
+            absolute[code] = (minimum, maximum)
+    keys = _bits(fd, EVIOCGBIT(EV_KEY, KEY_CNT // 8), KEY_CNT // 8) if EV_KEY in events else []
+    rumble = EV_FF in events and FF_RUMBLE in _bits(fd, EVIOCGBIT(EV_FF, 16), 16)
+    props = _bits(fd, EVIOCGPROP, INPUT_PROP_CNT // 8)
+    return {'name': name, 'id': device_id, 'abs': absolute, 'keys': keys, 'props': props, 'rumble': rumble}
+
+
+def is_joystick(capabilities):
+    # a simplified SDL_EVDEV_GuessDeviceClass: joystick or gamepad buttons, or both stick axes and any key,
+    # as long as the device is not a touchpad, touchscreen, tablet, mouse or motion sensor
+    keys = capabilities['keys']
+    props = capabilities.get('props', [])  # recorded streams may predate input properties
+    if any(prop in props for prop in (INPUT_PROP_POINTER, INPUT_PROP_DIRECT, INPUT_PROP_ACCELEROMETER)):
+        return False
+    if any(key in keys for key in (BTN_TOOL_FINGER, BTN_TOOL_PEN, BTN_STYLUS, BTN_MOUSE)):
+        return False
+    return any(BTN_JOYSTICK <= key <= BTN_THUMBR for key in keys) or \
+        (0 in capabilities['abs'] and 1 in capabilities['abs'] and bool(keys))
+
+
+class EvdevJoystick:
+    """
+    Reads a Linux evdev device directly, without SDL, and answers like a pygame joystick.
+
+    pump() drains every queued struct input_event with as few reads as possible and applies them to the
+    axis, button and hat state, so the PyGameButtonMapping maps and get_xbox_report_from_pymap work unchanged.
+    Axes and buttons are numbered in the order SDL gives them. Any file descriptor carrying input events,
+    such as a pipe replaying a recorded stream, can be read when its capabilities are passed in.
+    """
+    def __init__(self, source, capabilities=None, instance_id=0):
+        self.path = source if isinstance(source, str) else None
+        if self.path:
+            try:
+                self.fd = os.open(self.path, os.O_RDWR | os.O_NONBLOCK)
+            except PermissionError:
+                # rumble needs write access, input does not
+                self.fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        else:
+            self.fd = source
+            os.set_blocking(self.fd, False)
+        if capabilities is None:
+            capabilities = query_capabilities(self.fd)
+            # event times on the same clock as time.monotonic() so latency can be measured
+            try:
+                fcntl.ioctl(self.fd, EVIOCSCLOCKID, struct.pack('i', CLOCK_MONOTONIC))
+            except OSError:
+                pass
+        self.capabilities = capabilities
+        self.instance_id = instance_id
+
+        # SDL numbering: absolute axes in code order except the hats, hats in pairs,
+        # joystick buttons first then the buttons below BTN_JOYSTICK
+        self.axis_map = {}
+        self.hat_map = {}
+        for code, (minimum, maximum) in sorted(capabilities['abs'].items()):
+            if ABS_HAT0X <= code <= ABS_HAT3Y:
+                self.hat_map[code] = ((code - ABS_HAT0X) // 2, (code - ABS_HAT0X) % 2)
+            else:
+                scale = 2 / (maximum - minimum) if maximum > minimum else 0
+                self.axis_map[code] = (len(self.axis_map), minimum, scale)
+        hat_numbers = sorted({hat for hat, _ in self.hat_map.values()})
+        self.hat_map = {code: (hat_numbers.index(hat), axis) for code, (hat, axis) in self.hat_map.items()}
+        keys = [key for key in sorted(capabilities['keys']) if key >= BTN_JOYSTICK] + \
+               [key for key in sorted(capabilities['keys']) if BTN_MISC <= key < BTN_JOYSTICK]
+        self.button_map = {key: index for index, key in enumerate(keys)}
+
+        self.axes = [0.0] * len(self.axis_map)
+        self.buttons = [0] * len(self.button_map)
+        self.hats = [[0, 0] for _ in hat_numbers]
+        self.read_buffer = bytearray(INPUT_EVENT.size * EVDEV_READ_EVENTS)
+        self.read_view = memoryview(self.read_buffer)
+        self.pending = 0  # bytes of a partial event left over from the last read
+        self.dropped = False
+        self.removed = False
+        self.last_event_time = 0.0
+        self.events = 0
+        self.reads = 0
+        self.rumble_id = -1
+        if self.path:
+            self._resync()
+
+    def fileno(self):
+        return self.fd
+
+    def _resync(self):
+        # read the current state back after the kernel dropped events
+        keys = fcntl.ioctl(self.fd, EVIOCGKEY, bytes(KEY_CNT // 8))
+        for key, index in self.button_map.items():
+            self.buttons[index] = keys[key // 8] >> key % 8 & 1
+        for code in self.capabilities['abs']:
+            value = INPUT_ABSINFO.unpack(fcntl.ioctl(self.fd, EVIOCGABS(code), bytes(24)))[0]
+            self._set_abs(code, value)
+
+    def _set_abs(self, code, value):
+        axis = self.axis_map.get(code)
+        if axis is not None:
+            index, minimum, scale = axis
+            self.axes[index] = (value - minimum) * scale - 1
+        else:
+            hat = self.hat_map.get(code)
+            if hat is not None:
+                # evdev hats point down the y axis, pygame hats point up it
+                self.hats[hat[0]][hat[1]] = -value if hat[1] else value
+
+    def pump(self):
+        """
+        Applies every input event waiting on the device.
+
+        Returns:
+            False once the device is gone
+        """
+        size = INPUT_EVENT.size
+        while not self.removed:
+            try:
+                count = os.readv(self.fd, [self.read_view[self.pending:]])
+            except BlockingIOError:
+                break
+            except OSError:
+                self.removed = True
+                break
+            if not count:
+                # the writing end of a stream was closed
+                self.removed = True
+                break
+            self.reads += 1
+            end = self.pending + count
+            whole = end - end % size
+            for seconds, microseconds, event_type, code, value in INPUT_EVENT.iter_unpack(self.read_view[:whole]):
+                if event_type == EV_ABS:
+                    self._set_abs(code, value)
+                elif event_type == EV_KEY:
+                    index = self.button_map.get(code)
+                    if index is not None:
+                        self.buttons[index] = 1 if value else 0
+                elif event_type == EV_SYN:
+                    if code == SYN_DROPPED:
+                        self.dropped = True
+                    elif code == SYN_REPORT and self.dropped:
+                        self.dropped = False
+                        if self.path:
+                            self._resync()
+                    self.last_event_time = seconds + microseconds / 1000000
+            self.events += whole // size
+            self.pending = end - whole
+            if self.pending:
+                self.read_buffer[:self.pending] = self.read_view[whole:end]
+            if end < len(self.read_buffer):
+                # a short read left the queue empty
+                break
+        return not self.removed
+
+    def init(self):
+        pass
+
+    def quit(self):
+        if self.fd is not None and self.path:
+            os.close(self.fd)
+            self.fd = None
+
+    def get_init(self):
+        return self.fd is not None
+
+    def get_name(self):
+        return self.capabilities['name']
+
+    def get_guid(self):
+        # laid out like SDL's linux joystick guids: bus, crc, vendor, product, version
+        bus, vendor, product, version = self.capabilities['id']
+        return struct.pack('<8H', bus, 0, vendor, 0, product, 0, version, 0).hex()
+
+    def get_instance_id(self):
+        return self.instance_id
+
+    def get_numaxes(self):
+        return len(self.axes)
+
+    def get_numbuttons(self):
+        return len(self.buttons)
+
+    def get_numhats(self):
+        return len(self.hats)
+
+    def get_axis(self, index):
+        return self.axes[index]
+
+    def get_button(self, index):
+        return self.buttons[index]
+
+    def get_hat(self, index):
+        x, y = self.hats[index]
+        return x, y
+
+    def rumble(self, low_frequency, high_frequency, duration):
+        if not self.capabilities['rumble']:
+            return False
+        effect = bytearray(FF_RUMBLE_EFFECT.pack(FF_RUMBLE, self.rumble_id, 0, 0, 0, min(duration, 0xFFFF), 0,
+                                                 int(min(low_frequency, 1) * 0xFFFF),
+                                                 int(min(high_frequency, 1) * 0xFFFF)))
+        try:
+            # uploading over the same effect id changes the playing effect
+            fcntl.ioctl(self.fd, EVIOCSFF, effect)
+            self.rumble_id = FF_RUMBLE_EFFECT.unpack(effect)[1]
+            os.write(self.fd, INPUT_EVENT.pack(0, 0, EV_FF, self.rumble_id, 1))
+        except OSError:
+            return False
+        return True
+
+    def stop_rumble(self):
+        if self.rumble_id < 0:
+            return
+        try:
+            os.write(self.fd, INPUT_EVENT.pack(0, 0, EV_FF, self.rumble_id, 0))
+        except OSError:
+            pass
+
+
+class _EvdevEvents:
+    # pygame.event for evdev joysticks: pumping reads the open devices, only hotplug events are queued
+    def __init__(self, joysticks):
+        self.joysticks = joysticks
+
+    def pump(self):
+        for joystick in list(self.joysticks.opened.values()):
+            if not joystick.pump():
+                self.joysticks.remove(joystick)
+
+    def get(self, event_type=None):
+        events = []
+        if event_type in (None, JOYDEVICEREMOVED):
+            events += [SimpleNamespace(type=JOYDEVICEREMOVED, instance_id=instance_id)
+                       for instance_id in self.joysticks.removed]
+            self.joysticks.removed = []
+        if event_type in (None, JOYDEVICEADDED):
+            # devices are only rescanned when someone is waiting for one to be added
+            known = set(self.joysticks.paths)
+            events += [SimpleNamespace(type=JOYDEVICEADDED, device_index=index)
+                       for index, path in enumerate(self.joysticks.scan()) if path not in known]
+        return events
+
+
+class _EvdevJoysticks:
+    # pygame.joystick for evdev devices
+    def __init__(self):
+        self.paths = []
+        self.capabilities = {}
+        self.opened = {}
+        self.removed = []
+        self.next_instance_id = 0
+
+    def scan(self):
+        paths = []
+        for path in sorted(glob.glob(EVDEV_PATHS), key=lambda p: int(p[len(EVDEV_PATHS) - 1:])):
+            if path not in self.capabilities:
+                try:
+                    fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+                except OSError:
+                    continue
+                try:
+                    self.capabilities[path] = query_capabilities(fd)
+                except OSError:
+                    continue
+                finally:
+                    os.close(fd)
+            if is_joystick(self.capabilities[path]):
+                paths.append(path)
+        self.paths = paths
+        return paths
+
+    def remove(self, joystick):
+        self.opened.pop(joystick.path, None)
+        self.capabilities.pop(joystick.path, None)
+        if joystick.path in self.paths:
+            self.paths.remove(joystick.path)
+        self.removed.append(joystick.instance_id)
+        joystick.quit()
+
+    def init(self):
+        self.scan()
+
+    def get_count(self):
+        return len(self.scan())
+
+    def Joystick(self, index):
+        path = self.paths[index]
+        if path not in self.opened:
+            self.opened[path] = EvdevJoystick(path, instance_id=self.next_instance_id)
+            self.next_instance_id += 1
+        return self.opened[path]
+
+
+class EvdevPygame:
+    """
+    Stands in for the parts of the pygame module JoySender's joystick code uses, backed by evdev devices.
+    """
+    JOYDEVICEADDED = JOYDEVICEADDED
+    JOYDEVICEREMOVED = JOYDEVICEREMOVED
+
+    def __init__(self):
+        self.joystick = _EvdevJoysticks()
+        self.event = _EvdevEvents(self.joystick)
+        self.display = SimpleNamespace(init=lambda: None)
+
+
+def record_evdev_stream(path, file_name, seconds):
+    """
+    Records the raw input events of an evdev device with its capabilities, for replaying through a pipe.
+    """
+    joystick = EvdevJoystick(path)
+    events = bytearray()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        try:
+            events += os.read(joystick.fd, INPUT_EVENT.size * EVDEV_READ_EVENTS)
+        except BlockingIOError:
+            time.sleep(.001)
+    joystick.quit()
+    with open(file_name, 'wb') as f:
+        pickle.dump({'capabilities': joystick.capabilities, 'events': bytes(events)}, f)
+
+
+def load_evdev_stream(file_name):
+    """
+    Returns:
+        A tuple of the recorded capabilities and the raw input events
+    """
+    with open(file_name, 'rb') as f:
+        stream = pickle.load(f)
+    return stream['capabilities'], stream['events']
+
+
+def replay_evdev_stream(events, fd, realtime=True):
+    # writes recorded events to fd one SYN_REPORT frame at a time, spaced as they were recorded
+    frame_start = 0
+    first_time = start = None
+    for offset in range(0, len(events) - INPUT_EVENT.size + 1, INPUT_EVENT.size):
+        seconds, microseconds, event_type, code, _ = INPUT_EVENT.unpack_from(events, offset)
+        if event_type != EV_SYN or code != SYN_REPORT:
+            continue
+        event_time = seconds + microseconds / 1000000
+        if realtime:
+            if first_time is None:
+                first_time, start = event_time, time.monotonic()
+            delay = start + event_time - first_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        os.write(fd, events[frame_start:offset + INPUT_EVENT.size])
+        frame_start = offset + INPUT_EVENT.size
+    os.close(fd)
@@ -0,0 +1,73 @@
+import select
+import time
+
+
+class EpollFrameWaiter:
+    """
+    Waits on the input device, the host socket and the frame timer together with one epoll instance.
+
+    The send loop calls wait() instead of blocking in a device read or sleeping in a frame limiter,
+    so a new input report is handled as soon as it arrives and the loop sleeps in the kernel otherwise.
+    The frame timer is the epoll timeout to the next keepalive frame, one frame period after the last send.
+    """
+    def __init__(self, device, host_socket, fps):
+        self.epoll = select.epoll()
+        self.device_fd = device.fileno()
+        self.host_fd = host_socket.fileno()
+        self.epoll.register(self.device_fd, select.EPOLLIN)
+        self.epoll.register(self.host_fd, select.EPOLLIN | select.EPOLLRDHUP)
+        self.device = device
+        self.was_nonblocking = getattr(device, 'nonblocking', False)
+        if hasattr(device, 'set_nonblocking'):
+            # readiness is known before reading, reads must never wait
+            device.set_nonblocking(True)
+        self.period = 1 / fps
+        self.next_frame_time = time.monotonic() + self.period
+        self.input_wakeups = 0
+        self.host_wakeups = 0
+        self.timer_wakeups = 0
+
+    def wait(self):
+        """
+        Blocks until the device has input, the host socket is readable or a keepalive frame is due.
+
+        Returns:
+            A tuple of whether the host socket is readable and whether a keepalive frame is due
+        """
+        host_ready = input_ready = False
+        for fd, _ in self.epoll.poll(max(0.0, self.next_frame_time - time.monotonic())):
+            if fd == self.device_fd:
+                input_ready = True
+            elif fd == self.host_fd:
+                host_ready = True
+        now = time.monotonic()
+        frame_due = now >= self.next_frame_time
+        if frame_due:
+            # a due frame is only offered once, the timer does not spin when nothing is sent
+            self.next_frame_time = now + self.period
+        self.input_wakeups += input_ready
+        self.host_wakeups += host_ready
+        self.timer_wakeups += frame_due and not input_ready
+        return host_ready, frame_due
+
+    def sent(self):
+        # the keepalive timer restarts with every frame sent
+        self.next_frame_time = time.monotonic() + self.period
+
+    def close(self):
+        # remapping and warm restarts read the device outside the loop and expect reads to wait again
+        self.epoll.close()
+        if hasattr(self.device, 'set_nonblocking'):
+            self.device.set_nonblocking(self.was_nonblocking)
+
+    def summary(self):
+        return (f"Event loop wakeups: {self.input_wakeups} input, {self.host_wakeups} host, "
+                f"{self.timer_wakeups} frame timer")
+
+
+def host_still_connected(host_socket):
+    # the host only talks in reply to a frame, a readable idle socket is either closing or out of step
+    try:
+        return bool(host_socket.recv(1024))
+    except OSError:
+        return False
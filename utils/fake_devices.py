@@ -0,0 +1,349 @@
+import pickle
+import random
+import struct
+import threading
+import time
+
+from .helper_functions import wait_ms
+
+FAKE_REPORT_RATE = 250  # reports per second, the DS4 USB rate
+FAKE_VENDOR_ID = 0xFFFF
+FAKE_PRODUCT_ID = 0x0001
+FAKE_REPORT_SIZE = 64
+FAKE_QUEUE_DEPTH = 64  # reports hidapi keeps queued for a reader that falls behind
+RANDOM_WALK_STEP = 6  # largest change of a stick or trigger byte per report
+BUTTON_TOGGLE_CHANCE = .02  # chance per report of a button changing state
+STICK_MOVE_CHANCE = .5  # chance per report of the sticks and triggers moving, a resting thumb holds still
+MOTION_REST = (0, 0, 0, 0, 8192, 0)  # gyro x, y, z, accel x, y, z of a controller lying flat
+
+# byte offset, bit offset, value of each input in the random walk report layout, as set by the HID mapping wizard
+FAKE_HID_MAP = {
+    'LEFT_STICK_X': (1, None, None), 'LEFT_STICK_Y': (2, None, None),
+    'RIGHT_STICK_X': (3, None, None), 'RIGHT_STICK_Y': (4, None, None),
+    'LEFT_TRIGGER': (8, None, None), 'RIGHT_TRIGGER': (9, None, None),
+    'DPAD_UP': (5, 0, '0000'), 'DPAD_RIGHT': (5, 0, '0010'), 'DPAD_DOWN': (5, 0, '0100'), 'DPAD_LEFT': (5, 0, '0110'),
+    'X': (5, 4, '1'), 'A': (5, 5, '1'), 'B': (5, 6, '1'), 'Y': (5, 7, '1'),
+    'LEFT_SHOULDER': (6, 0, '1'), 'RIGHT_SHOULDER': (6, 1, '1'), 'BACK': (6, 4, '1'), 'START': (6, 5, '1'),
+    'LEFT_THUMB': (6, 6, '1'), 'RIGHT_THUMB': (6, 7, '1'), 'GUIDE': (7, 0, '1'),
+}
+
+
+# Frame sources, endless generators of HID reports or pygame joystick states
+# a pygame joystick state is a tuple of (axes, buttons, hats)
+def looped_frames(frames):
+    # replay a finite list of frames forever
+    while True:
+        for frame in frames:
+            yield frame
+
+
+def load_script(filename, rate_hz, pygame_frames=False):
+    """
+    Loads a frame script, one frame per line held for a number of milliseconds, '#' starts a comment.
+
+    HID lines are `<hold_ms> <hex bytes>`, missing bytes are zero:
+        100 01 80 80 80 80 08 00
+    pygame lines are `<hold_ms> | <axes> | <buttons> | <hats>`, hats written as x,y:
+        100 | 0.5 -0.25 0 0 -1 -1 | 1 0 0 0 | 0,1
+
+    Returns:
+        A list of frames with each frame repeated once per report it is held for
+    """
+    frames = []
+    with open(filename) as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            if pygame_frames:
+                hold, axes, buttons, hats = line.split('|')
+                frame = (tuple(float(value) for value in axes.split()),
+                         tuple(int(value) for value in buttons.split()),
+                         tuple(tuple(int(value) for value in hat.split(',')) for hat in hats.split()))
+            else:
+                hold, _, data = line.partition(' ')
+                frame = [int(value, 16) for value in data.split()]
+                frame += [0] * (FAKE_REPORT_SIZE - len(frame))
+            frames += [frame] * max(1, round(float(hold) * rate_hz / 1000))
+    if not frames:
+        raise ValueError(f"script {filename} has no frames")
+    return frames
+
+
+def save_capture(filename, frames):
+    with open(filename, 'wb') as f:
+        pickle.dump(list(frames), f)
+
+
+def load_capture(filename):
+    with open(filename, 'rb') as f:
+        frames = pickle.load(f)
+    if not frames:
+        raise ValueError(f"capture {filename} has no frames")
+    return frames
+
+
+def record_hid_capture(device, filename, num_reports=1000, report_size=FAKE_REPORT_SIZE):
+    # reads reports from a real device at its own rate so they can be replayed by a FakeHidDevice
+    save_capture(filename, [list(device.read(report_size)) for _ in range(num_reports)])
+
+
+def record_pygame_capture(pygame, joystick, filename, num_frames=1000, rate_hz=FAKE_REPORT_RATE):
+    # samples a real joystick at rate_hz so it can be replayed by a FakeJoystick
+    frames = []
+    for _ in range(num_frames):
+        pygame.event.pump()
+        frames.append((tuple(joystick.get_axis(i) for i in range(joystick.get_numaxes())),
+                       tuple(joystick.get_button(i) for i in range(joystick.get_numbuttons())),
+                       tuple(joystick.get_hat(i) for i in range(joystick.get_numhats()))))
+        wait_ms(1000 // rate_hz)
+    save_capture(filename, frames)
+
+
+def walk(value, low, high, rest, rng):
+    # a random step that drifts back towards the rest value
+    step = rng.randint(-RANDOM_WALK_STEP, RANDOM_WALK_STEP) - (value - rest) // 16
+    return min(high, max(low, value + step))
+
+
+def random_walk_hid_reports(seed=None, size=FAKE_REPORT_SIZE):
+    """
+    Generates DS4 USB style reports: sticks on bytes 1-4, hat and face buttons on byte 5,
+    other buttons on byte 6, a report counter on byte 7, triggers on bytes 8-9
+    and gyro and accelerometer noise on bytes 13-24.
+    """
+    rng = random.Random(seed)
+    report = [0] * size
+    report[0] = 0x01
+    report[1:5] = [0x80] * 4
+    report[5] = 0x08
+    motion = list(MOTION_REST)
+    counter = 0
+    while True:
+        if rng.random() < STICK_MOVE_CHANCE:
+            for i in range(1, 5):
+                report[i] = walk(report[i], 0, 255, 0x80, rng)
+            for i in (8, 9):
+                report[i] = walk(report[i], 0, 255, 0, rng)
+        for i in range(6):
+            motion[i] = walk(motion[i], -32768, 32767, MOTION_REST[i], rng)
+        report[13:25] = struct.pack('<6h', *motion)
+        if rng.random() < BUTTON_TOGGLE_CHANCE:
+            report[5] ^= 1 << rng.randint(4, 7)
+        if rng.random() < BUTTON_TOGGLE_CHANCE:
+            report[6] ^= 1 << rng.randint(0, 7)
+        counter = (counter + 1) & 0x3f
+        report[7] = counter << 2
+        yield list(report)
+
+
+def random_walk_pygame_states(seed=None, num_axes=6, num_buttons=15, num_hats=1):
+    # sticks rest at 0, triggers on the last two axes rest at -1
+    rng = random.Random(seed)
+    axes = [0] * (num_axes - 2) + [-127, -127]
+    buttons = [0] * num_buttons
+    hats = [(0, 0)] * num_hats
+    while True:
+        for i in range(num_axes):
+            rest = -127 if i >= num_axes - 2 else 0
+            axes[i] = walk(axes[i], -127, 127, rest, rng)
+        if rng.random() < BUTTON_TOGGLE_CHANCE:
+            i = rng.randrange(num_buttons)
+            buttons[i] ^= 1
+        if num_hats and rng.random() < BUTTON_TOGGLE_CHANCE:
+            hats[0] = (rng.randint(-1, 1), rng.randint(-1, 1))
+        yield tuple(axis / 127 for axis in axes), tuple(buttons), tuple(hats)
+
+
+def set_fake_hid_mapping(buttons):
+    # fills a HIDButtonMapping for the random walk report layout
+    for name, (byte_offset, bit_offset, value) in FAKE_HID_MAP.items():
+        getattr(buttons, name).set(byte_offset, bit_offset, value)
+    return buttons
+
+
+def get_frame_source(source, rate_hz, pygame_frames=False):
+    """
+    Builds a frame generator from a source description.
+
+    Args:
+        source (str): 'random', 'random:<seed>', 'script:<file>' or 'capture:<file>'
+
+    Returns:
+        An endless generator of HID reports, or of pygame joystick states if pygame_frames is set
+    """
+    kind, _, argument = source.partition(':')
+    if kind == 'random':
+        seed = int(argument) if argument else None
+        return random_walk_pygame_states(seed) if pygame_frames else random_walk_hid_reports(seed)
+    if kind == 'script':
+        return looped_frames(load_script(argument, rate_hz, pygame_frames))
+    if kind == 'capture':
+        return looped_frames(load_capture(argument))
+    raise ValueError(f"unknown fake device source '{source}'")
+
+
+class FakeHidDevice:
+    """
+    Stands in for a hid.device, producing reports from a frame source at a fixed report rate.
+
+    Reports that come due while nobody reads are queued like hidapi does, up to FAKE_QUEUE_DEPTH of them.
+    Output and feature reports written to it are counted and the last one is kept.
+    """
+    def __init__(self, frames, rate_hz=FAKE_REPORT_RATE, product_string='Fake HID Gamepad'):
+        self.frames = frames
+        self.period = 1 / rate_hz
+        self.product_string = product_string
+        self.nonblocking = False
+        self.next_report_time = time.monotonic()
+        self.writes = 0
+        self.last_output_report = None
+
+    def read(self, max_length, timeout_ms=0):
+        now = time.monotonic()
+        # a reader that fell behind finds at most a full queue of reports waiting
+        self.next_report_time = max(self.next_report_time, now - FAKE_QUEUE_DEPTH * self.period)
+        wait = self.next_report_time - now
+        if wait > 0:
+            if self.nonblocking:
+                return []
+            if timeout_ms > 0 and wait * 1000 > timeout_ms:
+                wait_ms(timeout_ms)
+                return []
+            time.sleep(wait)
+        self.next_report_time += self.period
+        return next(self.frames)[:max_length]
+
+    def get_feature_report(self, report_id, max_length):
+        return [report_id] + [0] * (max_length - 1)
+
+    def send_feature_report(self, data):
+        return len(data)
+
+    def write(self, data):
+        self.writes += 1
+        self.last_output_report = list(data)
+        return len(data)
+
+    def set_nonblocking(self, nonblocking):
+        self.nonblocking = bool(nonblocking)
+        return 0
+
+    def get_product_string(self):
+        return self.product_string
+
+    def get_manufacturer_string(self):
+        return 'JoySendPy'
+
+    def get_serial_number_string(self):
+        return 'FAKE-0001'
+
+    def close(self):
+        pass
+
+
+class FakeJoystick:
+    """
+    Stands in for a pygame joystick, its state follows a frame source at a fixed rate.
+    Rumble requests are counted and the last one is kept.
+    """
+    def __init__(self, frames, rate_hz=FAKE_REPORT_RATE, name='Fake Joystick'):
+        self.frames = frames
+        self.period = 1 / rate_hz
+        self.name = name
+        self.axes, self.buttons, self.hats = next(frames)
+        self.next_frame_time = time.monotonic() + self.period
+        self.rumbles = 0
+        self.rumble_state = (0, 0, 0)
+
+    def _update(self):
+        # advance to the frame that is current now, skipping at most one queue's worth
+        now = time.monotonic()
+        if now - self.next_frame_time > FAKE_QUEUE_DEPTH * self.period:
+            self.next_frame_time = now - FAKE_QUEUE_DEPTH * self.period
+        while self.next_frame_time <= now:
+            self.axes, self.buttons, self.hats = next(self.frames)
+            self.next_frame_time += self.period
+
+    def init(self):
+        pass
+
+    def quit(self):
+        pass
+
+    def get_init(self):
+        return True
+
+    def get_name(self):
+        return self.name
+
+    def get_guid(self):
+        return 'fa4e0000000000000000000000000000'
+
+    def get_instance_id(self):
+        return -1
+
+    def get_numaxes(self):
+        return len(self.axes)
+
+    def get_numbuttons(self):
+        return len(self.buttons)
+
+    def get_numhats(self):
+        return len(self.hats)
+
+    def get_axis(self, index):
+        self._update()
+        return self.axes[index]
+
+    def get_button(self, index):
+        self._update()
+        return self.buttons[index]
+
+    def get_hat(self, index):
+        self._update()
+        return self.hats[index]
+
+    def rumble(self, low_frequency, high_frequency, duration):
+        self.rumbles += 1
+        self.rumble_state = (low_frequency, high_frequency, duration)
+        return True
+
+    def stop_rumble(self):
+        self.rumble_state = (0, 0, 0)
+
+
+class FakeHotplugMonitor:
+    """
+    The HidHotplugMonitor interface for a fake device, which can never be unplugged.
+    """
+    interval = 1.0
+
+    def __init__(self):
+        self.present = threading.Event()
+        self.present.set()
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+    def is_present(self):
+        return True
+
+    def mark_lost(self):
+        pass
+
+
+def open_fake_device(op_mode, source='random', rate_hz=FAKE_REPORT_RATE):
+    """
+    Opens a fake device for an operational mode, a FakeJoystick for mode 1 and a FakeHidDevice otherwise.
+
+    Returns:
+        A tuple of the device, vendor id and product id
+    """
+    print(f"Using fake device '{source}' at {rate_hz} Hz")
+    if op_mode == 1:
+        return FakeJoystick(get_frame_source(source, rate_hz, pygame_frames=True), rate_hz), None, None
+    return FakeHidDevice(get_frame_source(source, rate_hz), rate_hz), FAKE_VENDOR_ID, FAKE_PRODUCT_ID
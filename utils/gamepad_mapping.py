@@ -1,15 +1,26 @@
 import time
 
-import keyboard
 import os
 import pickle
+from operator import itemgetter
 from .helper_functions import *
+from .hotkeys import wait_for_key_release
 from .xbox_reports import XBOX_REPORT, XBOX_BUTTON
 
+keyboard = LazyModule('keyboard')
+
 APP_NAME = 'joyClient'  # saved maps will be in %APPDATA%/APP_NAME
 STICK_THRESHOLD = 24  # stick HID input must change value by threshold to be noticed
 AXIS_INPUT_DEADZONE = 3600
 RUMBLE_CONVERSION = .00392
+CALIBRATION_VALIDATION_SAMPLES = 8  # reports sampled to validate a cached calibration
+CALIBRATION_DRIFT_TOLERANCE = 4  # stick HID bytes may wander this far from the cached rest value
+PYGAME_DRIFT_TOLERANCE = .1  # pygame axes may wander this far from the cached rest value
+WIZARD_READ_TIMEOUT_MS = 50  # mapping wizard hid reads wait this long so ESC is still noticed
+WIZARD_POLL_INTERVAL_MS = 10  # mapping wizard polls pygame inputs at this interval
+
+# calibrations loaded or measured this session, keyed by calibration file
+calibration_cache = {}
 
 
 class PyGameButtonMapping_old:
@@ -379,11 +390,11 @@ class HIDButtonMapping:
         return sorted(generic_names, key=lambda x: len(x))
 
 
-def check_for_saved_mapping(_filename) -> []:
+def check_for_saved_mapping(_filename, extension='map') -> []:
     # appdata_folder = os.getenv('APPDATA')
     # save_folder = os.path.join(appdata_folder, APP_NAME)
     save_folder = '.\\'
-    filename = os.path.join(save_folder, f'{_filename}.map')
+    filename = os.path.join(save_folder, f'{_filename}.{extension}')
 
     if not os.path.exists(save_folder):
         os.makedirs(save_folder)
@@ -395,6 +406,145 @@ def check_for_saved_mapping(_filename) -> []:
         return [False, filename]
 
 
+# Calibration cache functions
+def save_calibration(filename, calibration):
+    calibration_cache[filename] = calibration
+    with open(filename, 'wb') as f:
+        pickle.dump(calibration, f)
+
+
+def load_calibration(filename, kind):
+    """
+    Returns the calibration saved for a device, or None if there is none of the requested kind.
+    Calibrations from this session are served from memory, otherwise they are read from disk.
+    """
+    calibration = calibration_cache.get(filename)
+    if calibration is None:
+        if not os.path.isfile(filename):
+            return None
+        try:
+            with open(filename, 'rb') as f:
+                calibration = pickle.load(f)
+        except Exception as e:
+            print(f"Warning: Could not load calibration {filename}: {e}")
+            return None
+    if not isinstance(calibration, dict) or calibration.get('kind') != kind:
+        return None
+    calibration_cache[filename] = calibration
+    return calibration
+
+
+def calculate_hid_calibration(gamepad):
+    # Obtain baseline controller readings and generate analytic reports
+    first_report, avg_report, median_report, mode_report, range_report = get_hid_data_stream_reports(gamepad)
+
+    # Rule out non-user input fields
+    ignore_indices = find_values_in(range_report, '>0')  # values that changed at all during the sample
+    ignore_indices += find_values_in(avg_report, '>133')  # average values higher than expected neutral sticks
+
+    # Intuit likely stick indices
+    stick_step1 = find_values_in(avg_report, '~127/12')  # expected neutral stick average within 12
+    stick_step2 = find_values_in(range_report, '~0/9')  # expected neutral stick range within 9
+    stick_indices = list(set(stick_step1).intersection(set(stick_step2)))
+
+    # filter out higher indexed possible sticks as they are likely motion controls
+    # the first four are usually the two main sticks
+    stick_indices = sorted(stick_indices)[:4]
+
+    return {
+        'kind': 'hid',
+        'timestamp': time.time(),
+        'reports': (first_report, avg_report, median_report, mode_report, range_report),
+        'ignore_indices': ignore_indices,
+        'stick_indices': stick_indices,
+    }
+
+
+def hid_calibration_has_drifted(gamepad, calibration) -> bool:
+    """
+    Takes a short sample of the idle controller and compares it to a cached calibration.
+
+    Returns:
+        True if the report layout or any rest value the mapping relies on has changed.
+    """
+    _, cached_avg, _, _, cached_range = calibration['reports']
+    _, avg_report, _, _, range_report = get_hid_data_stream_reports(gamepad, CALIBRATION_VALIDATION_SAMPLES)
+    if len(avg_report) != len(cached_avg):
+        return True
+
+    ignore_indices = set(calibration['ignore_indices'])
+    stick_indices = set(calibration['stick_indices'])
+    for i in range(len(avg_report)):
+        if i in stick_indices:
+            # sticks may wander a little within their measured noise
+            if abs(avg_report[i] - cached_avg[i]) > max([cached_range[i] * 2, CALIBRATION_DRIFT_TOLERANCE]):
+                return True
+        elif i not in ignore_indices:
+            # every other watched byte was perfectly still when calibrated
+            if avg_report[i] != cached_avg[i] or range_report[i]:
+                return True
+    return False
+
+
+def get_hid_calibration(gamepad, calibration_file=None):
+    # Reuse a cached calibration unless the device has drifted since it was measured
+    if calibration_file:
+        calibration = load_calibration(calibration_file, 'hid')
+        if calibration and not hid_calibration_has_drifted(gamepad, calibration):
+            print(f"Using calibration from {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(calibration['timestamp']))}")
+            return calibration
+
+    calibration = calculate_hid_calibration(gamepad)
+    if calibration_file:
+        save_calibration(calibration_file, calibration)
+    return calibration
+
+
+def calculate_pygame_calibration(pygame, gamepad):
+    input_info, baseline_reports = get_pygamepad_baseline(pygame, gamepad, 16)
+    return {
+        'kind': 'pygame',
+        'timestamp': time.time(),
+        'input_info': input_info,
+        'reports': baseline_reports,
+        'axis_rest_values': baseline_reports[0][:input_info[0]],
+    }
+
+
+def pygame_calibration_has_drifted(pygame, gamepad, calibration) -> bool:
+    """
+    Takes a short sample of the idle controller and compares it to a cached calibration.
+
+    Returns:
+        True if the input counts or any axis rest value have changed.
+    """
+    input_info, baseline_reports = get_pygamepad_baseline(pygame, gamepad, CALIBRATION_VALIDATION_SAMPLES)
+    if input_info != calibration['input_info']:
+        return True
+
+    avg_report = baseline_reports[0]
+    num_axes = input_info[0]
+    for i in range(num_axes):
+        if abs(avg_report[i] - calibration['axis_rest_values'][i]) > PYGAME_DRIFT_TOLERANCE:
+            return True
+    # buttons and hats should all be at rest
+    return any(avg_report[num_axes:])
+
+
+def get_pygame_calibration(pygame, gamepad, calibration_file=None):
+    # Reuse a cached calibration unless the device has drifted since it was measured
+    if calibration_file:
+        calibration = load_calibration(calibration_file, 'pygame')
+        if calibration and not pygame_calibration_has_drifted(pygame, gamepad, calibration):
+            print(f"Using calibration from {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(calibration['timestamp']))}")
+            return calibration
+
+    calibration = calculate_pygame_calibration(pygame, gamepad)
+    if calibration_file:
+        save_calibration(calibration_file, calibration)
+    return calibration
+
+
 def input_verb(type):
     if type == 3:
         return "squeeze"
@@ -413,9 +563,16 @@ def format_input_name(name: str) -> str:
 
 # HID mapping functions
 def get_xbox_report_from_hidmap(gamepad, report_size, buttons, input_lists: ([[str]]), xbox_report: XBOX_REPORT):
+    # Receive new input report, the previous values are kept if none arrives in time
+    report = gamepad.read(report_size, HID_READ_TIMEOUT_MS)
+    if not report:
+        return False
+    decode_xbox_report_from_hidmap(report, buttons, input_lists, xbox_report)
+    return True
+
+
+def decode_xbox_report_from_hidmap(report, buttons, input_lists: ([[str]]), xbox_report: XBOX_REPORT):
     (stick_list, trigger_list, button_list) = input_lists
-    # Receive new input report
-    report = gamepad.read(report_size)
 
     for input_name in stick_list:
         button_value = get_xbox_input_from_bytearray('XBOX_' + input_name,
@@ -521,12 +678,30 @@ def hat_check(byte_offset, report):
     return False
 
 
+def get_watched_bytes_getter(size, ignore_indices):
+    # returns a function picking the bytes not ignored out of a report, used to skip repeated reports
+    watched_indices = [i for i in range(size) if i not in ignore_indices]
+    if not watched_indices:
+        return lambda report: ()
+    return itemgetter(*watched_indices)
+
+
 def wait_for_no_hid_gamepad_input(gamepad, ignore_indices, stick_indices):
+    ignore_indices = set(ignore_indices)
+    watched_bytes = get_watched_bytes_getter(report_size, ignore_indices)
+    last_watched = None
     awaiting_silence = True
     while awaiting_silence:
         results_canceled = 0
-        # Receive updates from the device
-        update = gamepad.read(report_size)
+        # Receive updates from the device, timed reads let the loop idle in the driver
+        update = gamepad.read(report_size, WIZARD_READ_TIMEOUT_MS)
+        if not update:
+            continue
+        # Reports that only differ in ignored bytes give the same result as the last one
+        watched = watched_bytes(update)
+        if watched == last_watched:
+            continue
+        last_watched = watched
         # Compare update to the average baseline reading, ignoring supplied indices
         results = get_diff_in_bytearrays(avg_baseline, update, ignore_indices)
 
@@ -543,14 +718,23 @@ def wait_for_no_hid_gamepad_input(gamepad, ignore_indices, stick_indices):
 
 def receive_single_hid_input_map(gamepad, ignore_indices, stick_indices):
     offset_byte = offset_bit = value = None
+    ignore_indices = set(ignore_indices)
+    watched_bytes = get_watched_bytes_getter(report_size, ignore_indices)
+    last_watched = None
     while True:
         # Allow for a user abort on input
         if keyboard.is_pressed('esc'):
-            while keyboard.is_pressed('esc'):
-                True
+            wait_for_key_release(['esc'])
             return None, None, None
-        # Receive updates from the device
-        update = gamepad.read(report_size)
+        # Receive updates from the device, timed reads let the loop idle in the driver
+        update = gamepad.read(report_size, WIZARD_READ_TIMEOUT_MS)
+        if not update:
+            continue
+        # Reports that only differ in ignored bytes give the same result as the last one
+        watched = watched_bytes(update)
+        if watched == last_watched:
+            continue
+        last_watched = watched
         # Find bytes with values different from their baseline average
         results = get_diff_in_bytearrays(avg_baseline, update, ignore_indices)
         # Filter results to remove stick gitter
@@ -589,7 +773,7 @@ def receive_single_hid_input_map(gamepad, ignore_indices, stick_indices):
                 return offset_byte, offset_bit, value
 
 
-def set_hid_mapping(gamepad, buttons: HIDButtonMapping, input_list: [str]):
+def set_hid_mapping(gamepad, buttons: HIDButtonMapping, input_list: [str], calibration_file=None):
     # Default Inputs (all)
     if not input_list:
         input_list = sum([buttons.get_all_stick_button_names(),
@@ -600,24 +784,15 @@ def set_hid_mapping(gamepad, buttons: HIDButtonMapping, input_list: [str]):
                           buttons.get_all_generic_button_names()
                           ], [])
 
-    # Obtain baseline controller readings and generate analytic reports
+    # Obtain baseline controller readings, reusing the cached calibration when it is still valid
     global first_baseline, avg_baseline, median_baseline, mode_baseline, range_baseline, report_size
-    first_baseline, avg_baseline, median_baseline, mode_baseline, range_baseline = \
-        get_hid_data_stream_reports(gamepad)
+    calibration = get_hid_calibration(gamepad, calibration_file)
+    first_baseline, avg_baseline, median_baseline, mode_baseline, range_baseline = calibration['reports']
     report_size = len(first_baseline)
 
-    # Rule out non-user input fields
-    ignore_indices = find_values_in(range_baseline, '>0')  # values that changed at all during the sample
-    ignore_indices += find_values_in(avg_baseline, '>133')  # average values higher than expected neutral sticks
-
-    # Intuit likely stick indices
-    stick_step1 = find_values_in(avg_baseline, '~127/12')  # expected neutral stick average within 12
-    stick_step2 = find_values_in(range_baseline, '~0/9')  # expected neutral stick range within 9
-    stick_indices = list(set(stick_step1).intersection(set(stick_step2)))
-
-    # filter out higher indexed possible sticks as they are likely motion controls
-    # the first four are usually the two main sticks
-    stick_indices = sorted(stick_indices)[:4]
+    # copy the indices so the cached calibration is never modified while mapping
+    ignore_indices = list(calibration['ignore_indices'])
+    stick_indices = list(calibration['stick_indices'])
 
     # remove gittery sticks from ignored indices
     # ignore_indices = [item for item in ignore_indices if item not in stick_indices]
@@ -669,7 +844,7 @@ def have_same_sign(val1, val2):
 
 
 # PyGame mapping functions
-def get_xbox_report_from_pymap(pygame, gamepad, buttons, input_list: [str], xbox_report: XBOX_REPORT):
+def get_xbox_report_from_pymap(pygame, gamepad, buttons, input_list: [str], xbox_report: XBOX_REPORT, pump=True):
     # Reset button values
     xbox_report.wButtons = 0
     xbox_report.sThumbLX = 0
@@ -679,8 +854,9 @@ def get_xbox_report_from_pymap(pygame, gamepad, buttons, input_list: [str], xbox
     xbox_report.bLeftTrigger = 0
     xbox_report.bRightTrigger = 0
 
-    # Receive new input events
-    pygame.event.pump()  # Efficiently update the event queue
+    # Receive new input events, unless the caller already has
+    if pump:
+        pygame.event.pump()  # Efficiently update the event queue
 
     for input_name in input_list:
         typ = getattr(buttons, input_name).input_type
@@ -895,6 +1071,8 @@ def wait_for_no_pygamepad_input(pygame, gamepad):
         # if no values are detected the function may exit
         if not axis_value + hat_value + button_value:
             awaiting_silence = False
+        else:
+            wait_ms(WIZARD_POLL_INTERVAL_MS)
         # print(f'hats:{hat_value}\t buttons:{button_value} \t axis:{axis_value}')
 
 
@@ -936,8 +1114,7 @@ def get_pygamepad_input(pygame, gamepad):
 
         # Allow for a user abort on input
         if keyboard.is_pressed('esc'):
-            while keyboard.is_pressed('esc'):
-                pygame.time.delay(10)  # Replace with a short delay to mimic Sleep(10)
+            wait_for_key_release(['esc'])
             return input
 
         # Iterate over all gamepad axes
@@ -957,6 +1134,9 @@ def get_pygamepad_input(pygame, gamepad):
             if hat_direction:
                 return DPAD, i, hat_direction
 
+        # Poll at a bounded interval instead of spinning
+        wait_ms(WIZARD_POLL_INTERVAL_MS)
+
 
 def get_pygame_input_array(pygame, gamepad, numaxes, numbuttons, numhats):
     pygame.event.pump()
@@ -1011,7 +1191,7 @@ def get_pygamepad_baseline(pygame, gamepad, NUM_SAMPLES=64):
     return (num_axes, num_buttons, num_hats, buf_size), (avg_report, median_report, mode_report, range_report)
 
 
-def set_pygame_mapping(pygame, gamepad, buttons: PyGameButtonMapping, input_list: [str]):
+def set_pygame_mapping(pygame, gamepad, buttons: PyGameButtonMapping, input_list: [str], calibration_file=None):
     # Default Inputs (all)
     if not input_list:
         input_list = sum([buttons.get_all_stick_button_names(),
@@ -1025,9 +1205,10 @@ def set_pygame_mapping(pygame, gamepad, buttons: PyGameButtonMapping, input_list
     # Create a dictionary to ensure no input is used twice
     received_input = {}
 
-    # Get Baseline Reading
+    # Get Baseline Reading, reusing the cached calibration when it is still valid
     global input_info, avg_baseline, median_baseline, mode_baseline, range_baseline
-    input_info, baseline_reports = get_pygamepad_baseline(pygame, gamepad, 16)
+    calibration = get_pygame_calibration(pygame, gamepad, calibration_file)
+    input_info, baseline_reports = calibration['input_info'], calibration['reports']
     num_inputs = input_info[3]
     avg_baseline, median_baseline, mode_baseline, range_baseline = baseline_reports
 
@@ -1069,4 +1250,6 @@ def set_pygame_mapping(pygame, gamepad, buttons: PyGameButtonMapping, input_list
 
 
 def pygame_rumble(gamepad, left_motor, right_motor, duration=200):
+    if not left_motor and not right_motor:
+        return gamepad.stop_rumble()
     return gamepad.rumble(left_motor * RUMBLE_CONVERSION, right_motor * RUMBLE_CONVERSION, duration)
@@ -1,17 +1,65 @@
 import time
-import hid
+import importlib
 import struct
+from contextlib import contextmanager
 from typing import Tuple
 from ctypes import *
 import ctypes
 
-import pygame.time
-
 DS4_REPORT_SIZE = 63
 DS4_REPORTING_DELAY = 4  # 4ms between output reports from ds4 controller
+HID_READ_TIMEOUT_MS = 1000  # hid reads give up after this long so a lost device can be noticed
+# DS4_REPORT_EX fields up to bBatteryLvlSpecial, packed
+DS4_REPORT_FORMAT = struct.Struct('<4BH3BHB6h5BB')
+
+# seconds spent importing and initialising each module, reported by --startup-profile
+startup_profile = {}
+
+
+# startup helpers
+@contextmanager
+def profile_step(name):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_profile[name] = startup_profile.get(name, 0) + time.perf_counter() - start_time
+
+
+def print_startup_profile():
+    print('Startup profile:')
+    for name, seconds in startup_profile.items():
+        print(f'  {name:<28}{seconds * 1000:9.2f} ms')
+
+
+class LazyModule:
+    """
+    Stands in for a module that is only imported the first time one of its attributes is used.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            with profile_step(f'import {self._name}'):
+                self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def use(self, module):
+        # a stand-in with the same interface is used instead, the real module is never imported
+        self._module = module
+
+
+hid = LazyModule('hid')
 
 
 # misc helpers
+def wait_ms(milliseconds):
+    if milliseconds > 0:
+        time.sleep(milliseconds / 1000)
+
+
 class FpsLimiter:
     def __init__(self, target_fps):
         self.target_fps = target_fps
@@ -26,7 +74,7 @@ class FpsLimiter:
         sleep_time = self.target_frame_time - elapsed_time
 
         if sleep_time > 0:
-            pygame.time.wait(int(sleep_time))
+            wait_ms(int(sleep_time))
 
         self.last_frame_time = current_time
 
@@ -75,25 +123,6 @@ ds4_bt_state_data = [
 ]
 
 
-def update_rumble(motor, val):
-    # Define static variables L and R
-    update_rumble.L = getattr(update_rumble, 'L', 0)
-    update_rumble.R = getattr(update_rumble, 'R', 0)
-
-    if motor == 'L':
-        if val == 0 and update_rumble.L == val:
-            return False
-        update_rumble.L = val
-        return True
-    elif motor == 'R':
-        if val == 0 and update_rumble.R == val:
-            return False
-        update_rumble.R = val
-        return True
-
-    return False
-
-
 rumble_values = bytearray([0, 0])
 
 
@@ -198,69 +227,35 @@ def unpack_xbox_report(data):
 
 # @time_function
 def byte_array_to_ds4_report_ex(byte_array, ds4_report_ex):
-    if len(byte_array) < ctypes.sizeof(ds4_report_ex):
-        byte_array += bytearray(ctypes.sizeof(ds4_report_ex) - len(byte_array))
-    ctypes.memmove(ctypes.addressof(ds4_report_ex), byte_array, ctypes.sizeof(ds4_report_ex))
-    #return ds4_report_ex
+    # copy as much of the report as there is, the caller's array is left as it is
+    size = min(len(byte_array), ctypes.sizeof(ds4_report_ex))
+    ctypes.memmove(ctypes.addressof(ds4_report_ex), bytes(byte_array), size)
 
 
 # @time_function
 def byte_array_to_ds4_report_ex_opt(byte_array, ds4_report_ptr):
-    #ctypes.memmove(ds4_report_ptr, byte_array, DS4_REPORT_SIZE)
-    return ctypes.cast(byte_array, ds4_report_ptr).contents  # less optimal
+    # map the report type over a bytearray without copying, the array must hold a whole report
+    return ds4_report_ptr._type_.from_buffer(byte_array)
 
 
 def unpack_ds4_report_ex(data, report):
-    if len(data) < 72:
-        data += bytearray(72 - len(data))
-    # Create a format string that matches the DS4_SUB_REPORT_EX structure
-    fmt = "bbbbHbbbHbhhhhhh5bb2bb" + "bb3bb3H" + 'bbb'
-
-    size_in_bytes = struct.calcsize(fmt)
-    print(f'Format size is: {size_in_bytes} bytes')
-    # Unpack the byte string into individual fields
-    unpacked_data = struct.unpack(fmt, data)
-    #unpacked_data_list = list(unpacked_data)
-    #print(data)
-    #print(unpacked_data)
-    #print((len(unpacked_data)))
-
-    #print(f'DS4 Buttons: {report.wButtons}')
-    # Create a DS4_SUB_REPORT_EX instance with the unpacked fields
-    report.bThumbLX = data[0]
-    report.bThumbLY = data[1]
-    report.bThumbRX = data[2]
-    report.bThumbRY = data[3]
-    report.wButtons = data[4]
-    report.bSpecial = unpacked_data[5]
-    report.bTriggerL = unpacked_data[6]
-    report.bTriggerR = unpacked_data[7]
-    report.wTimestamp = unpacked_data[8]
-    report.bBatteryLvl = unpacked_data[9]
-    report.wGyroX = unpacked_data[10]
-    report.wGyroY = unpacked_data[11]
-    report.wGyroZ = unpacked_data[12]
-    report.wAccelX = unpacked_data[13]
-    report.wAccelY = unpacked_data[14]
-    report.wAccelZ = unpacked_data[15]
-    report._bUnknown1 = unpacked_data[16:21]
-    report.bBatteryLvlSpecial = unpacked_data[21]
-
-    # Convert the bTouchData1 field to a c_byte_Array_3 instance
-    #bTouchData1 = (c_byte * 3)(*unpacked_data[13:16])
-
-    # Convert the bTouchData2 field to a c_short_Array_3 instance
-    #bTouchData2 = (c_short * 3)(*unpacked_data[21:24])
-
-    # Convert the unpacked data to a list and replace the bTouchData1 and bTouchData2 fields
-    #unpacked_data_list = list(unpacked_data)
-    # unpacked_data_list[13:16] = [bTouchData1]
-    # unpacked_data_list[21:24] = [bTouchData2]
+    """
+    Fills a DS4_REPORT_EX from the input report bytes that follow ds4_data_offset.
+    See utils.ds4_reports.new_ds4_report_buffer for a view that needs no unpacking at all.
 
+    Returns:
+        The filled report
+    """
+    if isinstance(data, list) or len(data) < DS4_REPORT_FORMAT.size:
+        data = bytes(data).ljust(DS4_REPORT_FORMAT.size, b'\0')
+    (report.bThumbLX, report.bThumbLY, report.bThumbRX, report.bThumbRY,
+     report.wButtons, report.bSpecial, report.bTriggerL, report.bTriggerR,
+     report.wTimestamp, report.bBatteryLvl,
+     report.wGyroX, report.wGyroY, report.wGyroZ, report.wAccelX, report.wAccelY, report.wAccelZ,
+     *unknown, report.bBatteryLvlSpecial) = DS4_REPORT_FORMAT.unpack_from(data)
+    report._bUnknown1[:] = unknown
     return report
 
-    #return unpacked_data
-
 
 # hid/pygame input selection
 def select_pygame_device(pygame, auto_select=0, other=False):
@@ -322,7 +317,7 @@ def select_hid_device(devices, auto_select=0, other=False):
 
 
 # hid report sampling
-def get_hid_data_stream_reports(device: hid.device, NUM_SAMPLES: int = 64) -> Tuple[bytes, bytes, bytes, bytes, bytes]:
+def get_hid_data_stream_reports(device: 'hid.device', NUM_SAMPLES: int = 64) -> Tuple[bytes, bytes, bytes, bytes, bytes]:
     """
     Collects and processes a data stream from a HID device using HIDAPI and returns various statistical reports on the data.
 
@@ -334,42 +329,45 @@ def get_hid_data_stream_reports(device: hid.device, NUM_SAMPLES: int = 64) -> Tu
         A tuple containing the first report received from the device, the average report, median report, mode report, and range report.
 
     Raises:
-        TypeError: if `device` is not an instance of `hidapi.Device`.
+        TypeError: if `device` cannot be read like a `hidapi.Device`.
     """
 
-    if not isinstance(device, hid.device):
-        raise TypeError("device must be an instance of hidapi.device")
+    # duck typed so fake devices can be sampled without importing hid
+    if not hasattr(device, 'read'):
+        raise TypeError("device must be readable like a hidapi.device")
 
     report_size = 64  # device.get_feature_report_length() or device.get_input_report_length()
     first_report = device.read(report_size)
     report_size = len(first_report)
-    sample_buf = [[[] for _ in range(report_size)] for _ in range(NUM_SAMPLES)]
-    avg_buffer = [0] * report_size
 
+    # Collect data from report
+    sample_buf = [device.read(report_size) for _ in range(NUM_SAMPLES)]
+
+    return (first_report,) + get_report_statistics(sample_buf, report_size)
+
+
+def get_report_statistics(sample_buf, report_size) -> Tuple[bytearray, bytearray, bytearray, bytearray]:
+    """
+    Calculates the average, median, mode and range of each byte index over a list of sampled reports.
+
+    Returns:
+        A tuple of the average report, median report, mode report and range report.
+    """
+    num_samples = len(sample_buf)
     avg_report = bytearray([0] * report_size)
     median_report = bytearray([0] * report_size)
     mode_report = bytearray([0] * report_size)
     range_report = bytearray([0] * report_size)
 
-    # Collect data from report
-    for i in range(NUM_SAMPLES):
-        report = device.read(report_size)
-        for j in range(report_size):
-            avg_buffer[j] += int(report[j])
-            sample_buf[i][j] = report[j]
-
-    # Calculate average for each byte index
-    # avg_report = bytearray([avg_buffer[i] // NUM_SAMPLES for i in range(report_size)])
-
     # Calculate average, median, mode and range for each byte index
     for j in range(report_size):
-        data = [sample_buf[i][j] for i in range(NUM_SAMPLES)]
-        avg_report[j] = avg_buffer[j] // NUM_SAMPLES
+        data = [int(sample_buf[i][j]) for i in range(num_samples)]
+        avg_report[j] = sum(data) // num_samples
         median_report[j] = get_median(data)
         mode_report[j] = get_mode(data)
         range_report[j] = get_range(data)
 
-    return first_report, avg_report, median_report, mode_report, range_report
+    return avg_report, median_report, mode_report, range_report
 
 
 def get_data_stream_mode(device, NUM_SAMPLES=64):
@@ -0,0 +1,76 @@
+from collections import OrderedDict
+from ctypes import addressof, memmove, sizeof
+from operator import itemgetter
+
+from .gamepad_mapping import decode_xbox_report_from_hidmap
+
+HID_DECODE_LRU_SIZE = 16  # recent results kept by --decode-lru without a size
+
+
+def get_mapped_bytes_getter(buttons, input_lists):
+    # returns a function picking the bytes the map reads out of a report, the decode only depends on these
+    mapped_indices = sorted({getattr(buttons, input_name).byte_offset
+                             for input_list in input_lists for input_name in input_list})
+    if not mapped_indices:
+        return lambda report: ()
+    return itemgetter(*mapped_indices)
+
+
+class HidDecodeCache:
+    """
+    Skips decoding HID reports whose mapped bytes are the same as the last report's.
+
+    Only the bytes the map reads make up a report's key, so counters and noise in unmapped bytes do not
+    count as a change. With lru_size set, the xbox reports of that many recent keys are also kept and
+    copied back instead of decoded, like a stick returning to centre or a button being released.
+    """
+    def __init__(self, buttons, input_lists, lru_size=0):
+        self.buttons = buttons
+        self.input_lists = input_lists
+        self.mapped_bytes = get_mapped_bytes_getter(buttons, input_lists)
+        self.lru_size = lru_size
+        self.recent = OrderedDict()
+        self.last_key = None
+        self.repeats = 0
+        self.lru_hits = 0
+        self.decodes = 0
+
+    def decode(self, report, xbox_report):
+        """
+        Sets xbox_report from report, the previous values stand if the mapped bytes have not changed.
+
+        Returns:
+            True if xbox_report may have changed
+        """
+        key = self.mapped_bytes(report)
+        if key == self.last_key:
+            self.repeats += 1
+            return False
+        self.last_key = key
+        if self.lru_size:
+            decoded = self.recent.get(key)
+            if decoded is not None:
+                self.recent.move_to_end(key)
+                memmove(addressof(xbox_report), decoded, sizeof(xbox_report))
+                self.lru_hits += 1
+                return True
+        decode_xbox_report_from_hidmap(report, self.buttons, self.input_lists, xbox_report)
+        self.decodes += 1
+        if self.lru_size:
+            self.recent[key] = bytes(xbox_report)
+            if len(self.recent) > self.lru_size:
+                self.recent.popitem(last=False)
+        return True
+
+    def clear(self):
+        self.recent.clear()
+        self.last_key = None
+
+    def hit_rate(self):
+        reports = self.repeats + self.lru_hits + self.decodes
+        return (self.repeats + self.lru_hits) / reports if reports else 0.0
+
+    def summary(self):
+        lru = f", {self.lru_hits} from the last {self.lru_size} results" if self.lru_size else ''
+        return (f"HID decode cache: {self.hit_rate():.1%} hits, {self.repeats} repeated reports{lru}, "
+                f"{self.decodes} decoded")
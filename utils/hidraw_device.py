@@ -0,0 +1,187 @@
+import fcntl
+import glob
+import os
+import select
+
+HIDRAW_BUFFER_SIZE = 4096  # the largest report hidraw hands out
+HIDRAW_SYSFS = '/sys/class/hidraw/*/device/uevent'
+
+
+def _ioc(direction, number, size):
+    # linux _IOC() for the 'H' hidraw ioctls
+    return direction << 30 | size << 16 | ord('H') << 8 | number
+
+
+def HIDIOCSFEATURE(length):
+    return _ioc(3, 0x06, length)
+
+
+def HIDIOCGFEATURE(length):
+    return _ioc(3, 0x07, length)
+
+
+def enumerate_hidraw_devices(vendor_id=0, product_id=0):
+    """
+    Lists the hidraw devices from sysfs, no device has to be opened.
+
+    Returns:
+        A list of device info dicts with the keys JoySender uses from hid.enumerate()
+    """
+    devices = []
+    for uevent in sorted(glob.glob(HIDRAW_SYSFS)):
+        try:
+            with open(uevent) as f:
+                fields = dict(line.rstrip('\n').split('=', 1) for line in f if '=' in line)
+        except OSError:
+            continue
+        if 'HID_ID' not in fields:
+            continue
+        # HID_ID=bus:vendor:product in hex
+        _, vendor, product = (int(part, 16) for part in fields['HID_ID'].split(':'))
+        if (vendor_id and vendor != vendor_id) or (product_id and product != product_id):
+            continue
+        name = uevent.split('/')[-3]
+        devices.append({
+            'path': f'/dev/{name}'.encode(),
+            'vendor_id': vendor,
+            'product_id': product,
+            'serial_number': fields.get('HID_UNIQ', ''),
+            'manufacturer_string': '',
+            'product_string': fields.get('HID_NAME', ''),
+            'interface_number': -1,
+        })
+    return devices
+
+
+class HidrawDevice:
+    """
+    Reads a Linux /dev/hidraw* device directly with the hid.device surface JoySender uses.
+
+    readinto() and readinto_latest() fill a caller's reused buffer without creating any objects per report,
+    read() still returns a new copy for callers that keep reports. Any file descriptor that keeps report
+    boundaries, like one end of a SOCK_SEQPACKET socketpair, can stand in for the device.
+    """
+    def __init__(self, fd=None):
+        self.fd = fd
+        self.info = {}
+        self.nonblocking = False
+        self.buffer = bytearray(HIDRAW_BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.poller = None
+        self.reads = 0
+        self.skipped = 0
+        if fd is not None:
+            self._opened(fd)
+
+    def _opened(self, fd):
+        self.fd = fd
+        os.set_blocking(fd, False)
+        self.poller = select.poll()
+        self.poller.register(fd, select.POLLIN)
+
+    def open(self, vendor_id, product_id, serial_number=None):
+        for info in enumerate_hidraw_devices(vendor_id, product_id):
+            if serial_number and info['serial_number'] != serial_number:
+                continue
+            self.open_path(info['path'])
+            self.info = info
+            return
+        raise OSError('open failed')
+
+    def open_path(self, path):
+        self._opened(os.open(path, os.O_RDWR))
+        self.info = next((info for info in enumerate_hidraw_devices()
+                          if info['path'] == (path if isinstance(path, bytes) else path.encode())), {})
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def fileno(self):
+        return self.fd
+
+    def set_nonblocking(self, nonblocking):
+        self.nonblocking = bool(nonblocking)
+        return 0
+
+    def _wait(self, timeout_ms):
+        # hid.device semantics: no timeout blocks unless the device was set non-blocking
+        if self.nonblocking:
+            return True
+        return bool(self.poller.poll(timeout_ms if timeout_ms > 0 else None))
+
+    def _read_now(self, buffer):
+        try:
+            count = os.readv(self.fd, [buffer])
+        except BlockingIOError:
+            return 0
+        if not count:
+            raise OSError('device closed')
+        self.reads += 1
+        return count
+
+    def readinto(self, buffer, timeout_ms=0):
+        """
+        Reads the next report into buffer.
+
+        Returns:
+            The report length, 0 if none arrived in time
+        """
+        if not self._wait(timeout_ms):
+            return 0
+        return self._read_now(buffer)
+
+    def readinto_latest(self, buffer, timeout_ms=0):
+        """
+        Waits for a report, then drains every queued report in one non-blocking burst so buffer holds the newest.
+
+        Returns:
+            The length of the newest report, 0 if none arrived in time
+        """
+        length = self.readinto(buffer, timeout_ms)
+        if not length:
+            return 0
+        while True:
+            count = self._read_now(buffer)
+            if not count:
+                return length
+            self.skipped += 1
+            length = count
+
+    def read(self, max_length, timeout_ms=0):
+        length = self.readinto(self.view[:max_length], timeout_ms)
+        return bytes(self.view[:length])
+
+    def write(self, data):
+        return os.write(self.fd, data if isinstance(data, (bytes, bytearray, memoryview)) else bytes(data))
+
+    def get_feature_report(self, report_id, max_length):
+        report = bytearray(max_length)
+        report[0] = report_id
+        length = fcntl.ioctl(self.fd, HIDIOCGFEATURE(max_length), report, True)
+        return list(report[:length])
+
+    def send_feature_report(self, data):
+        report = bytearray(data)
+        return fcntl.ioctl(self.fd, HIDIOCSFEATURE(len(report)), report, True)
+
+    def get_manufacturer_string(self):
+        return self.info.get('manufacturer_string', '')
+
+    def get_product_string(self):
+        return self.info.get('product_string', '')
+
+    def get_serial_number_string(self):
+        return self.info.get('serial_number', '')
+
+
+class HidrawModule:
+    """
+    Stands in for the hid module, see LazyModule.use().
+    """
+    device = HidrawDevice
+
+    @staticmethod
+    def enumerate(vendor_id=0, product_id=0):
+        return enumerate_hidraw_devices(vendor_id, product_id)
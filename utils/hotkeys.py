@@ -0,0 +1,54 @@
+import threading
+
+from .helper_functions import LazyModule
+
+keyboard = LazyModule('keyboard')
+
+
+class HotkeyFlags:
+    """
+    Watches for hotkeys once through a keyboard hook. A pressed hotkey sets `triggered` to its combo,
+    so a loop can check for any hotkey with a single attribute read.
+
+    A combo counts as pressed while other keys are held too, so a mode number can be held with Shift+R.
+    """
+    def __init__(self, *combos):
+        self.combos = combos
+        self.triggered = None
+        self._registered = False
+
+    def register(self):
+        if not self._registered:
+            # keyboard.add_hotkey only fires when exactly the combo's keys are held
+            keyboard.on_press(self._check)
+            self._registered = True
+        return self
+
+    def _check(self, event):
+        # runs on the keyboard hook thread, a single attribute store is atomic
+        for combo in self.combos:
+            if keyboard.is_pressed(combo):
+                self.triggered = combo
+                return
+
+    def clear(self):
+        self.triggered = None
+
+
+def wait_for_key_release(keys):
+    """
+    Blocks on keyboard events until none of the given keys are held.
+    """
+    released = threading.Event()
+
+    def check(event=None):
+        if not any(keyboard.is_pressed(key) for key in keys):
+            released.set()
+
+    # hook before the first check so a release between the two is not missed
+    hook = keyboard.on_release(check)
+    try:
+        check()
+        released.wait()
+    finally:
+        keyboard.unhook(hook)
@@ -0,0 +1,167 @@
+import os
+import socket
+import struct
+import multiprocessing
+from multiprocessing import shared_memory
+
+from .helper_functions import FpsLimiter, wait_ms
+
+FRAME_SLOT_SIZE = 64  # largest frame sent to the host (ds4 passthrough)
+RUMBLE_SLOT_SIZE = 2  # left and right rumble bytes from the host
+CONNECT_TIMEOUT = 10  # seconds the input process waits for the network process handshake
+STOP_TIMEOUT = 2  # seconds the network process is given to stop before it is killed
+
+
+class SharedFrameSlot:
+    """
+    A single-writer seqlock slot in shared memory holding the latest frame written to it.
+
+    The header holds a sequence number and the payload length. The sequence is odd while a write
+    is in progress, readers retry until they copy a payload with the same even sequence on both sides.
+    """
+    HEADER = struct.Struct('<IH')  # sequence, payload length
+    SEQUENCE = struct.Struct('<I')
+
+    def __init__(self, name=None, size=FRAME_SLOT_SIZE):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.HEADER.size + size)
+            self.size = size
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.size = self.shm.size - self.HEADER.size
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+        self._sequence = self.SEQUENCE.unpack_from(self.buf, 0)[0]
+
+    def write(self, data):
+        length = len(data)
+        if length > self.size:
+            raise ValueError(f"frame of {length} bytes does not fit a {self.size} byte slot")
+        # odd sequence marks the slot as being written, the length only changes while it is odd
+        self._sequence += 1
+        self.HEADER.pack_into(self.buf, 0, self._sequence, length)
+        self.buf[self.HEADER.size:self.HEADER.size + length] = data
+        self._sequence += 1
+        self.SEQUENCE.pack_into(self.buf, 0, self._sequence)
+
+    def read(self):
+        """
+        Returns:
+            A tuple of the sequence number and a copy of the freshest payload, sequence 0 means nothing was written
+        """
+        while True:
+            sequence, length = self.HEADER.unpack_from(self.buf, 0)
+            if sequence & 1:
+                continue
+            data = bytes(self.buf[self.HEADER.size:self.HEADER.size + length])
+            if self.SEQUENCE.unpack_from(self.buf, 0)[0] == sequence:
+                return sequence, data
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def pin_to_cpu(cpu):
+    # pinning is only available on linux, elsewhere the scheduler decides
+    if cpu is None:
+        return False
+    if not hasattr(os, 'sched_setaffinity'):
+        print("<< CPU pinning is not supported on this platform >>")
+        return False
+    os.sched_setaffinity(0, {cpu})
+    return True
+
+
+def run_network_process(frame_name, rumble_name, host, port, fps, op_mode, cpu, connected, stop):
+    # Owns the host socket, sends the freshest frame on its own schedule and publishes rumble
+    # until stop is set, SIGTERM can not be relied on as the process inherits any handler SDL installed
+    pin_to_cpu(cpu)
+    frames = SharedFrameSlot(frame_name)
+    rumble = SharedFrameSlot(rumble_name)
+    client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        client_socket.connect((host, port))
+        client_socket.sendall(str(f'{fps}:{op_mode}').encode())
+        client_socket.recv(1024)
+        connected.set()
+
+        clock = FpsLimiter(fps)
+        while not stop.is_set():
+            sequence, frame = frames.read()
+            if not sequence:
+                # the input process has not produced a frame yet
+                wait_ms(1)
+                continue
+            client_socket.sendall(frame)
+            response = client_socket.recv(1024)
+            if not response:
+                break
+            rumble.write(response[:RUMBLE_SLOT_SIZE])
+            clock.tick()
+    except OSError:
+        pass
+    finally:
+        client_socket.close()
+        frames.close()
+        rumble.close()
+
+
+class SplitConnection:
+    """
+    Stands in for the host socket in the input process when the network runs in its own process.
+
+    sendall publishes a frame to the shared slot and recv returns the latest rumble state,
+    neither of them block on the network.
+    """
+    def __init__(self, host, port, fps, op_mode, network_cpu=None):
+        self.frames = SharedFrameSlot(size=FRAME_SLOT_SIZE)
+        self.rumble = SharedFrameSlot(size=RUMBLE_SLOT_SIZE)
+        self.connected = multiprocessing.Event()
+        self.stop = multiprocessing.Event()
+        self.process = multiprocessing.Process(
+            target=run_network_process,
+            args=(self.frames.name, self.rumble.name, host, port, fps, op_mode, network_cpu, self.connected,
+                  self.stop),
+            daemon=True)
+        self.closed = False
+
+    def start(self):
+        # True once the network process has completed the handshake with the host
+        self.process.start()
+        waited = 0
+        while not self.connected.wait(.05):
+            waited += .05
+            if not self.process.is_alive() or waited > CONNECT_TIMEOUT:
+                self.close()
+                return False
+        return True
+
+    def sendall(self, data):
+        if not self.process.is_alive():
+            raise ConnectionError("network process has stopped")
+        self.frames.write(data)
+
+    def recv(self, bufsize):
+        sequence, data = self.rumble.read()
+        return data if sequence else bytes(RUMBLE_SLOT_SIZE)
+
+    def fileno(self):
+        return -1 if self.closed else 0
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.stop.set()
+        # a process stuck connecting or waiting on the host is killed, SIGKILL can not be handled
+        self.process.join(STOP_TIMEOUT)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        for slot in (self.frames, self.rumble):
+            slot.close()
+            slot.unlink()
@@ -0,0 +1,127 @@
+import ctypes
+import gc
+import os
+import statistics
+import time
+from array import array
+
+from .stage_timers import percentile
+
+REALTIME_BASELINE_FRAMES = 500  # frames timed with normal settings before realtime mode is entered
+REALTIME_SAMPLES = 4096  # frame times kept for each jitter report
+REALTIME_GC_IDLE_MS = 2  # a collection is only run when at least this much of the frame is left idle
+SCHED_FIFO_PRIORITY = 10
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+
+def lock_memory():
+    # mlockall has no os wrapper, the process needs CAP_IPC_LOCK or a large enough RLIMIT_MEMLOCK
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+        raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+
+class RealtimeMode:
+    """
+    Keeps the send loop's frame times steady once startup is over.
+
+    The first baseline_frames frames run with normal settings. After that all objects alive are frozen out
+    of the cyclic GC and automatic collection is turned off, collect_when_idle() runs collections in time
+    the frame would otherwise spend sleeping. The process is pinned to cpus and, when asked and permitted,
+    scheduled SCHED_FIFO with its memory locked. Frame times before and after are kept for summary().
+    """
+    def __init__(self, cpus=None, fifo=False, lock=False, baseline_frames=REALTIME_BASELINE_FRAMES):
+        self.cpus = cpus
+        self.fifo = fifo
+        self.lock = lock
+        self.baseline_frames = baseline_frames
+        self.frame_times = (array('d', [0.0]) * REALTIME_SAMPLES, array('d', [0.0]) * REALTIME_SAMPLES)
+        self.counts = [0, 0]
+        self.last_frame = None
+        self.active = False
+        self.applied = False
+        self.collections = 0
+
+    def frame_sent(self):
+        now = time.perf_counter()
+        if self.last_frame is not None:
+            phase = 1 if self.active else 0
+            count = self.counts[phase]
+            self.frame_times[phase][count % REALTIME_SAMPLES] = now - self.last_frame
+            self.counts[phase] = count + 1
+        self.last_frame = now
+        if not self.active and self.counts[0] >= self.baseline_frames:
+            self.enter()
+            # the switch itself is not part of either measurement
+            self.last_frame = time.perf_counter()
+
+    def enter(self):
+        gc.collect()
+        gc.freeze()
+        gc.disable()
+        self.active = True
+        if not self.applied:
+            self.applied = True
+            self._apply_scheduling()
+
+    def _apply_scheduling(self):
+        # each setting is optional, one that is not permitted is reported and skipped
+        applied = ['gc frozen']
+        if self.cpus:
+            try:
+                os.sched_setaffinity(0, self.cpus)
+                applied.append(f"pinned to cpus {','.join(str(cpu) for cpu in sorted(self.cpus))}")
+            except (AttributeError, OSError) as error:
+                print(f"<< CPU pinning failed: {error} >>")
+        if self.fifo:
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(SCHED_FIFO_PRIORITY))
+                applied.append('SCHED_FIFO')
+            except (AttributeError, OSError) as error:
+                print(f"<< SCHED_FIFO not permitted: {error} >>")
+        if self.lock:
+            try:
+                lock_memory()
+                applied.append('memory locked')
+            except (AttributeError, OSError) as error:
+                print(f"<< mlockall not permitted: {error} >>")
+        print(f"Realtime mode: {', '.join(applied)}")
+
+    def leave(self):
+        # outside the send loop the GC runs as usual again, frozen objects stay frozen
+        if self.active:
+            gc.enable()
+            self.active = False
+            self.last_frame = None
+
+    def collect_when_idle(self, idle_seconds):
+        if not self.active or idle_seconds * 1000 < REALTIME_GC_IDLE_MS:
+            return
+        counts = gc.get_count()
+        thresholds = gc.get_threshold()
+        if counts[0] < thresholds[0]:
+            return
+        # the same generation choice automatic collection would have made
+        generation = 2 if counts[2] >= thresholds[2] else 1 if counts[1] >= thresholds[1] else 0
+        gc.collect(generation)
+        self.collections += 1
+
+    def _jitter(self, phase):
+        count = min(self.counts[phase], REALTIME_SAMPLES)
+        if count < 2:
+            return 'no frames'
+        values = sorted(self.frame_times[phase][:count])
+        return (f"p50 {percentile(values, 50) * 1000:.3f}  p99 {percentile(values, 99) * 1000:.3f}  "
+                f"max {values[-1] * 1000:.3f}  stdev {statistics.pstdev(values) * 1000:.3f} ms")
+
+    def summary(self):
+        return (f"Frame time before realtime: {self._jitter(0)}\n"
+                f"Frame time in realtime:     {self._jitter(1)}, {self.collections} idle collections")
+
+
+def parse_realtime_cpus(cpus):
+    # --realtime CPU,CPU,...
+    if not cpus:
+        return None
+    return {int(cpu) for cpu in cpus.split(',')}
@@ -0,0 +1,49 @@
+import time
+
+PYGAME_RUMBLE_DURATION_MS = 200  # how long a pygame rumble command keeps the motors running
+RUMBLE_REFRESH_MARGIN_MS = 50  # re-issue a held level this long before the device would stop it
+
+
+class RumbleState:
+    """
+    Tracks the rumble level last sent to one device and only issues a device command when it matters.
+
+    A command is sent when the level changes, or when a held level is about to run out on a device
+    whose rumble commands expire after duration_ms. Devices that hold their level until told
+    otherwise pass duration_ms=None and are never refreshed.
+    """
+    def __init__(self, send, duration_ms=None, refresh_margin_ms=RUMBLE_REFRESH_MARGIN_MS):
+        self.send = send
+        self.duration = duration_ms / 1000 if duration_ms else None
+        self.refresh_margin = refresh_margin_ms / 1000
+        self.left = 0
+        self.right = 0
+        self.expires = 0.0
+        self.issued = 0
+        self.suppressed = 0
+
+    def update(self, left, right):
+        """
+        Returns:
+            True if a command was sent to the device
+        """
+        now = time.monotonic()
+        if (left, right) == (self.left, self.right):
+            # an unchanged level only needs refreshing while the motors are running
+            if not (left or right) or not self.duration or now < self.expires - self.refresh_margin:
+                self.suppressed += 1
+                return False
+        self.send(left, right)
+        self.left, self.right = left, right
+        if self.duration:
+            self.expires = now + self.duration
+        self.issued += 1
+        return True
+
+    def stop(self):
+        # turn the motors off if they may still be running
+        if self.left or self.right:
+            self.update(0, 0)
+
+    def summary(self):
+        return f"Rumble writes: {self.issued} issued, {self.suppressed} suppressed"
@@ -0,0 +1,75 @@
+import os
+import pickle
+import time
+
+from .helper_functions import hid
+
+SESSION_FILE = os.path.join(os.curdir, 'last_session.session')  # saved in the working directory
+
+
+def save_session(session, filename=SESSION_FILE):
+    # a session that can not be saved only costs the next --resume, never the running client
+    session['timestamp'] = time.time()
+    try:
+        os.makedirs(os.path.dirname(filename) or os.curdir, exist_ok=True)
+        with open(filename, 'wb') as f:
+            pickle.dump(session, f)
+    except OSError as e:
+        print(f"Warning: Could not save session {filename}: {e}")
+
+
+def load_session(filename=SESSION_FILE):
+    """
+    Returns the last saved session, or None if there is no usable session file.
+    """
+    if not os.path.isfile(filename):
+        return None
+    try:
+        with open(filename, 'rb') as f:
+            session = pickle.load(f)
+    except Exception as e:
+        print(f"Warning: Could not load session {filename}: {e}")
+        return None
+    return session if isinstance(session, dict) else None
+
+
+def get_device_fingerprint(gamepad, op_mode, vendor_id=None, product_id=None):
+    # enough information to find the exact same device again after a relaunch
+    if op_mode == 1:
+        return {'guid': gamepad.get_guid(), 'name': gamepad.get_name()}
+    try:
+        serial_number = gamepad.get_serial_number_string()
+    except (OSError, IOError):
+        serial_number = None
+    return {'vendor_id': vendor_id, 'product_id': product_id, 'serial_number': serial_number}
+
+
+def open_session_device(pygame, session):
+    """
+    Reopens the device recorded in a session without any interactive selection.
+
+    Returns:
+        A tuple of the opened device, vendor id and product id, or (None, None, None) if it is not attached
+    """
+    fingerprint = session['device']
+    if session['op_mode'] == 1:
+        for i in range(pygame.joystick.get_count()):
+            joystick = pygame.joystick.Joystick(i)
+            if joystick.get_guid() == fingerprint['guid'] and joystick.get_name() == fingerprint['name']:
+                joystick.init()
+                print(f"Using joystick '{joystick.get_name()}'")
+                return joystick, None, None
+        return None, None, None
+
+    vendor_id, product_id = fingerprint['vendor_id'], fingerprint['product_id']
+    for device_info in hid.enumerate(vendor_id, product_id):
+        if fingerprint['serial_number'] and device_info['serial_number'] != fingerprint['serial_number']:
+            continue
+        device = hid.device()
+        try:
+            device.open_path(device_info['path'])
+        except (OSError, IOError):
+            continue
+        print(f"Using joystick '{device_info['product_string']}'")
+        return device, vendor_id, product_id
+    return None, None, None
@@ -0,0 +1,96 @@
+import json
+import time
+from array import array
+
+# send loop stages in the order they run each frame
+STAGE_READ = 0
+STAGE_DECODE = 1
+STAGE_PACK = 2
+STAGE_SEND = 3
+STAGE_RECV = 4
+STAGE_RUMBLE = 5
+STAGE_LIMITER = 6
+STAGE_NAMES = ('read', 'decode', 'pack', 'send', 'recv', 'rumble', 'limiter')
+
+
+def percentile(sorted_values, p):
+    # nearest-rank percentile of an already sorted sequence
+    if not sorted_values:
+        return 0.0
+    rank = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+class StageTimers:
+    """
+    Accumulates per-stage durations of the send loop into preallocated ring buffers.
+
+    Each frame starts with begin(), then lap(stage) records the time since the previous mark
+    against that stage. Recording only happens while `enabled` is set.
+    """
+    def __init__(self, stage_names=STAGE_NAMES, capacity=4096):
+        self.stage_names = stage_names
+        self.capacity = capacity
+        self.starts = [array('d', [0.0]) * capacity for _ in stage_names]
+        self.durations = [array('d', [0.0]) * capacity for _ in stage_names]
+        self.counts = [0] * len(stage_names)
+        self.enabled = False
+        self._mark = 0.0
+
+    def reset(self):
+        self.counts = [0] * len(self.stage_names)
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        return self.enabled
+
+    def begin(self):
+        self._mark = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        count = self.counts[stage]
+        slot = count % self.capacity
+        self.starts[stage][slot] = self._mark
+        self.durations[stage][slot] = now - self._mark
+        self.counts[stage] = count + 1
+        self._mark = now
+
+    def samples(self, stage):
+        # the recorded durations of a stage, oldest samples are dropped once the ring is full
+        count = min(self.counts[stage], self.capacity)
+        return self.durations[stage][:count]
+
+    def summary(self):
+        """
+        Returns:
+            A printable table of per-stage sample counts and percentiles in milliseconds
+        """
+        lines = [f"{'stage':<10}{'count':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}{'total':>11}"]
+        for stage, name in enumerate(self.stage_names):
+            values = sorted(self.samples(stage))
+            if not values:
+                continue
+            lines.append(f"{name:<10}{self.counts[stage]:>8}"
+                         f"{percentile(values, 50) * 1000:>10.3f}{percentile(values, 90) * 1000:>10.3f}"
+                         f"{percentile(values, 99) * 1000:>10.3f}{values[-1] * 1000:>10.3f}"
+                         f"{sum(values) * 1000:>11.1f}")
+        return '\n'.join(lines)
+
+    def write_chrome_trace(self, filename):
+        # complete ("X") events viewable in chrome://tracing or Perfetto
+        events = []
+        for stage, name in enumerate(self.stage_names):
+            count = min(self.counts[stage], self.capacity)
+            for slot in range(count):
+                events.append({
+                    'name': name,
+                    'ph': 'X',
+                    'ts': self.starts[stage][slot] * 1e6,
+                    'dur': self.durations[stage][slot] * 1e6,
+                    'pid': 0,
+                    'tid': 0,
+                })
+        events.sort(key=lambda event: event['ts'])
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
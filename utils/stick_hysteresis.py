@@ -0,0 +1,88 @@
+from .gamepad_mapping import CALIBRATION_DRIFT_TOLERANCE
+
+STICK_HYSTERESIS_STRENGTH = 1.0  # multiples of the noise band a stick byte must move to update
+# the wizard only maps bytes that were perfectly still when calibrated, so their measured range is always 0,
+# a band is at least the wander a cached calibration tolerates
+STICK_NOISE_FLOOR = CALIBRATION_DRIFT_TOLERANCE
+
+
+def get_stick_noise_bands(buttons, stick_list, calibration, strength=STICK_HYSTERESIS_STRENGTH,
+                          noise_floor=STICK_NOISE_FLOOR):
+    """
+    Finds the rest value and noise band of each stick mapped to a whole byte, the calibrated noise range
+    or noise_floor, whichever is larger, times strength.
+
+    Returns:
+        A list of (byte_offset, rest_value, band) tuples, sticks mapped to buttons are left out
+    """
+    _, avg_report, _, _, range_report = calibration['reports']
+    bands = []
+    for input_name in stick_list:
+        button = getattr(buttons, input_name)
+        # sticks by button are bits, only whole byte sticks are noisy
+        if button.bit_offset or button.value or button.byte_offset is None:
+            continue
+        if button.byte_offset >= len(range_report):
+            continue
+        bands.append((button.byte_offset, round(avg_report[button.byte_offset]),
+                      max(range_report[button.byte_offset], noise_floor) * strength))
+    return bands
+
+
+class StickHysteresis:
+    """
+    Holds each whole byte stick at its last value until it moves beyond its calibrated noise band.
+
+    A stick that reaches or crosses its rest value always updates, so it is never held off centre.
+    Reports are copied into one reused buffer with the held stick values put back, the reports handed in
+    are never changed.
+    """
+    def __init__(self, bands, report_size=64):
+        self.bands = bands
+        self.held = [rest for _, rest, _ in bands]
+        self.buffer = bytearray(report_size)
+        self.view = memoryview(self.buffer)
+        self.report = self.view
+        self.filtered = 0
+        self.updates = 0
+
+    def apply(self, report):
+        """
+        Returns:
+            A view of the report with stick noise held back, valid until the next call
+        """
+        length = len(report)
+        if length > len(self.buffer):
+            self.buffer = bytearray(length)
+            self.view = memoryview(self.buffer)
+        if len(self.report) != length:
+            self.report = self.view[:length]
+        self.buffer[:length] = report
+        for axis, (offset, rest, band) in enumerate(self.bands):
+            if offset >= length:
+                continue
+            value = report[offset]
+            held = self.held[axis]
+            if value == held:
+                continue
+            if abs(value - held) > band or value == rest or (value - rest) * (held - rest) < 0:
+                self.held[axis] = value
+                self.updates += 1
+            else:
+                self.buffer[offset] = held
+                self.filtered += 1
+        return self.report
+
+    def summary(self):
+        return f"Stick hysteresis: {self.filtered} noisy updates filtered, {self.updates} passed"
+
+
+def get_stick_hysteresis(buttons, stick_list, calibration, strength=STICK_HYSTERESIS_STRENGTH):
+    # None when it is turned off, there is no calibration to take the noise floor from or no stick to filter
+    if strength <= 0:
+        return None
+    if not calibration:
+        print("<< No saved calibration, stick hysteresis is off until the device is remapped >>")
+        return None
+    bands = get_stick_noise_bands(buttons, stick_list, calibration, strength)
+    return StickHysteresis(bands) if bands else None